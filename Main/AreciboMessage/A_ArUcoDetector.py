@@ -1,9 +1,13 @@
+import os
+import time
+
 import cv2
 import numpy as np
 import math
 
 import zmq
-import pickle
+
+from transport import LATEST, FrameRing, FrameSubLink, PubLink
 
 
 MARKER_LENGTH = 0.02
@@ -11,114 +15,437 @@ MARKER_LENGTH = 0.02
 ZMQ_FRAME_PORT = 5555   # from file C
 ZMQ_ARUCO_PORT = 5556  # to file B
 
+# Delivery policy per link (see transport.py); must match the other end
+FRAME_LINK_POLICY = LATEST   # detect on the newest frame, skip stale ones
+ARUCO_LINK_POLICY = LATEST
+
+# -------- Camera calibration --------
+# Written by TTT/CameraCalibration.py; camera_params.npz in the working
+# directory is still used when the cache is missing
+CALIBRATION_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "camera_calibration.npz")
+CALIBRATION_VERSION = 1
+UNDISTORT = False   # remap frames with the cached maps before detection
+
+# -------- ROI tracking --------
+ROI_TRACKING = True       # False: full-frame detection on every frame
+ROI_MARGIN = 0.6          # ROI grows by this fraction of the marker size on each side
+ROI_MIN_PAD = 24          # ... but by at least this many pixels
+FULL_SCAN_PERIOD = 1.0    # s of capture time between full-frame scans (finds new markers)
+LOST_KEEP_FRAMES = 15     # frames a lost marker's ROI is still searched
+
+# -------- Pose --------
+# "fast": centre and in-plane yaw from undistorted corners (what B uses)
+# "pnp":  full 3D pose per marker, yaw taken from its rotation
+POSE_MODE = "fast"
+
+# Marker corners in the order detectMarkers and SOLVEPNP_IPPE_SQUARE use
+MARKER_OBJ_POINTS = np.array([
+    [-MARKER_LENGTH / 2,  MARKER_LENGTH / 2, 0],
+    [ MARKER_LENGTH / 2,  MARKER_LENGTH / 2, 0],
+    [ MARKER_LENGTH / 2, -MARKER_LENGTH / 2, 0],
+    [-MARKER_LENGTH / 2, -MARKER_LENGTH / 2, 0]
+], dtype=np.float32)
+
 # Calculate yaw angle
 def get_yaw_from_rvec(rvec):
     R, _ = cv2.Rodrigues(rvec)
     yaw = math.atan2(R[1, 0], R[0, 0])
     return np.degrees(yaw)
 
-def run():
+
+def load_calibration():
+    """Returns camera_matrix, dist_coeffs and the undistortion maps.
+
+    maps is (map1, map2, new_camera_matrix, (w, h)), or None when only the
+    legacy camera_params.npz is available.
+    """
+    if os.path.exists(CALIBRATION_FILE):
+        data = np.load(CALIBRATION_FILE)
+        if int(data["version"]) == CALIBRATION_VERSION:
+            size = tuple(int(v) for v in data["image_size"])
+            maps = (data["map1"], data["map2"], data["new_camera_matrix"], size)
+            return data["camera_matrix"], data["dist_coeffs"], maps
+        print(f"Ignoring {CALIBRATION_FILE}: version {int(data['version'])}, "
+              f"expected {CALIBRATION_VERSION}")
+
+    params = np.load("camera_params.npz")
+    return params["camera_matrix"], params["dist_coeffs"], None
+
+
+def fast_poses(corners, camera_matrix, dist_coeffs):
+    """(u, v, yaw) per marker without solving for the 3D pose.
+
+    The centre is the mean of the image corners, as in pnp mode. For the
+    yaw all corners are undistorted in one undistortPoints call (back to
+    pixel coordinates); the direction of the marker's x axis (top and
+    bottom edges) is what get_yaw_from_rvec returns for the 3D rotation.
+    """
+    pts = np.concatenate([c.reshape(-1, 4, 2) for c in corners]).astype(np.float32)
+    centre = pts.mean(axis=1)
+    und = cv2.undistortPoints(pts.reshape(-1, 1, 2), camera_matrix, dist_coeffs,
+                              P=camera_matrix).reshape(-1, 4, 2)
+    x_axis = (und[:, 1] - und[:, 0]) + (und[:, 2] - und[:, 3])
+    yaw = np.degrees(np.arctan2(x_axis[:, 1], x_axis[:, 0]))
+    return [(float(u), float(v), float(y)) for (u, v), y in zip(centre, yaw)]
+
+
+def pnp_poses(corners, ids, camera_matrix, dist_coeffs, prev_rvecs):
+    """(u, v, yaw) per marker from a full SOLVEPNP_IPPE_SQUARE pose.
+
+    IPPE returns both poses a square can have; the one closest to the
+    marker's previous rotation (prev_rvecs, id -> rvec, updated here) is
+    kept, so the pose does not flip between frames.
+    """
+    poses = []
+    for c, marker_id in zip(corners, ids.flatten().tolist()):
+        img_points = c.reshape(4, 2).astype(np.float32)
+        _, rvecs, _, _ = cv2.solvePnPGeneric(
+            MARKER_OBJ_POINTS,
+            img_points,
+            camera_matrix,
+            dist_coeffs,
+            flags=cv2.SOLVEPNP_IPPE_SQUARE
+        )
+        prev = prev_rvecs.get(marker_id)
+        if prev is None:
+            rvec = rvecs[0]   # sorted by reprojection error
+        else:
+            rvec = min(rvecs, key=lambda r: float(np.linalg.norm(r - prev)))
+        prev_rvecs[marker_id] = rvec
+
+        u = float(np.mean(img_points[:, 0]))
+        v = float(np.mean(img_points[:, 1]))
+        poses.append((u, v, float(get_yaw_from_rvec(rvec))))
+    return poses
+
+
+def _merge_rois(rois):
+    """Union overlapping boxes until all are disjoint, so a marker lies
+    in at most one of them and is never reported twice."""
+    rois = list(rois)
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(rois)):
+            for j in range(i + 1, len(rois)):
+                a, b = rois[i], rois[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    rois[i] = (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+                    del rois[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return rois
+
+
+def marker_rois(corners, frame_shape):
+    """Expanded, merged (x0, y0, x1, y1) search boxes around marker corners."""
+    h, w = frame_shape[:2]
+    rois = []
+    for c in corners:
+        pts = c.reshape(-1, 2)
+        x0, y0 = pts.min(axis=0)
+        x1, y1 = pts.max(axis=0)
+        pad = max(ROI_MIN_PAD, ROI_MARGIN * max(x1 - x0, y1 - y0))
+        rois.append((max(0, int(x0 - pad)), max(0, int(y0 - pad)),
+                     min(w, int(math.ceil(x1 + pad))), min(h, int(math.ceil(y1 + pad)))))
+    return _merge_rois(rois)
+
+
+class MarkerTracker:
+    """detectMarkers restricted to the neighbourhood of known markers.
+
+    Detection runs only inside expanded ROIs around the previous corners
+    of each marker id (ids are unique per prism). A full-frame scan runs
+    every FULL_SCAN_PERIOD seconds of capture time, when nothing is
+    tracked, or when a marker seen in the previous frame is not found in
+    its ROI. The period is in time, not frames: C forwards only about one
+    frame per second of a still scene, and a marker placed without much
+    motion must still be found. Lost markers keep their last ROI for
+    LOST_KEEP_FRAMES, so one that was briefly covered is picked up again
+    without waiting for a full scan.
+
+    Methods
+    - detect(gray, t) -> corners, ids (same format as detectMarkers); t is the
+      capture timestamp in seconds
+    """
+
+    def __init__(self, detector):
+        self.detector = detector
+        self.known = {}       # id -> [corners, frames missed]
+        self.last_full = None   # capture time of the last full scan
+        self.full_scans = 0
+        self.roi_scans = 0
+
+    def _full(self, gray, t):
+        self.full_scans += 1
+        self.last_full = t
+        corners, ids, _ = self.detector.detectMarkers(gray)
+        return corners, ids
+
+    def _in_rois(self, gray):
+        self.roi_scans += 1
+        found_corners = []
+        found_ids = []
+        rois = marker_rois([c for c, _ in self.known.values()], gray.shape)
+        for x0, y0, x1, y1 in rois:
+            # Slicing keeps a view; the detector only reads it
+            corners, ids, _ = self.detector.detectMarkers(gray[y0:y1, x0:x1])
+            if ids is None:
+                continue
+            offset = np.array([x0, y0], dtype=np.float32)
+            found_corners.extend(c + offset for c in corners)
+            found_ids.append(ids)
+        if not found_ids:
+            return (), None
+        # ids is (N, 1) or (N,) depending on the OpenCV version
+        return tuple(found_corners), np.concatenate([i.reshape(-1, 1) for i in found_ids])
+
+    def detect(self, gray, t):
+        if not self.known or self.last_full is None or t - self.last_full >= FULL_SCAN_PERIOD:
+            corners, ids = self._full(gray, t)
+        else:
+            corners, ids = self._in_rois(gray)
+            found = set() if ids is None else set(ids.flatten().tolist())
+            # A marker seen last frame went missing (left its ROI or covered)
+            if any(missed == 0 and i not in found for i, (_, missed) in self.known.items()):
+                corners, ids = self._full(gray, t)
+
+        found = {} if ids is None else dict(zip(ids.flatten().tolist(), corners))
+        for i, entry in list(self.known.items()):
+            if i not in found:
+                entry[1] += 1
+                if entry[1] > LOST_KEEP_FRAMES:
+                    del self.known[i]
+        for i, c in found.items():
+            self.known[i] = [c, 0]
+        return corners, ids
+
+
+# -------- Marker tracks --------
+TRACK_LOST_AFTER = 5        # missed frames before a marker is declared lost
+POS_DEADBAND = 1.0          # px; smaller moves are not published
+YAW_DEADBAND = 1.0          # degrees
+SCENE_KEEPALIVE = 1.0       # s; an unchanged scene is resent this often for late subscribers
+# One-Euro filter: cutoff (Hz) rises with speed, so slow jitter is smoothed
+# heavily while real motion passes with little lag
+ONE_EURO_MIN_CUTOFF = 1.0
+ONE_EURO_BETA = 0.05
+ONE_EURO_D_CUTOFF = 1.0
+
+
+def _wrap_deg(a):
+    return (a + 180.0) % 360.0 - 180.0
+
+
+class OneEuroFilter:
+    """One-Euro low-pass filter for a single scalar with timestamps in seconds."""
+
+    def __init__(self, x, t, min_cutoff=ONE_EURO_MIN_CUTOFF, beta=ONE_EURO_BETA,
+                 d_cutoff=ONE_EURO_D_CUTOFF):
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.x = x
+        self.dx = 0.0
+        self.t = t
+
+    @staticmethod
+    def _alpha(cutoff, dt):
+        tau = 1.0 / (2.0 * math.pi * cutoff)
+        return 1.0 / (1.0 + tau / dt)
+
+    def __call__(self, x, t):
+        dt = t - self.t
+        if dt <= 0:
+            return self.x
+        self.t = t
+        a_d = self._alpha(self.d_cutoff, dt)
+        self.dx += a_d * ((x - self.x) / dt - self.dx)
+        cutoff = self.min_cutoff + self.beta * abs(self.dx)
+        self.x += self._alpha(cutoff, dt) * (x - self.x)
+        return self.x
+
+
+class MarkerTrack:
+    """Smoothed pose of one marker id and the pose last published for it."""
+
+    def __init__(self, marker_id, u, v, yaw, t):
+        self.id = marker_id
+        self.fx = OneEuroFilter(u, t)
+        self.fy = OneEuroFilter(v, t)
+        # Yaw is filtered unwrapped, so crossing +-180 is not a jump
+        self.fyaw = OneEuroFilter(yaw, t)
+        self.pose = (u, v, yaw)
+        self.published = None
+        self.missed = 0
+
+    def update(self, u, v, yaw, t):
+        yaw = self.fyaw.x + _wrap_deg(yaw - self.fyaw.x)
+        self.pose = (self.fx(u, t), self.fy(v, t), self.fyaw(yaw, t))
+        self.missed = 0
+
+    def moved(self):
+        """True (and remember the pose) when it moved past the deadbands."""
+        u, v, yaw = self.pose
+        if self.published is not None:
+            pu, pv, pyaw = self.published
+            if (abs(u - pu) < POS_DEADBAND and abs(v - pv) < POS_DEADBAND
+                    and abs(_wrap_deg(yaw - pyaw)) < YAW_DEADBAND):
+                return False
+        self.published = self.pose
+        return True
+
+
+class TrackManager:
+    """Per-id marker tracks between detection and publishing.
+
+    A marker missing for up to TRACK_LOST_AFTER frames keeps its last pose,
+    so a single bad frame does not empty B's scene. update() tells whether
+    the published scene changed (a track appeared, was lost, or moved past
+    the deadbands); only then does it need to be sent right away.
+
+    Methods
+    - update(detections, t) -> changed, lost ids
+    - markers() -> list of {id, x, y, yaw} as published
+    """
+
+    def __init__(self):
+        self.tracks = {}
+
+    def update(self, detections, t):
+        changed = False
+        seen = set()
+        for marker_id, u, v, yaw in detections:
+            seen.add(marker_id)
+            track = self.tracks.get(marker_id)
+            if track is None:
+                self.tracks[marker_id] = MarkerTrack(marker_id, u, v, yaw, t)
+            else:
+                track.update(u, v, yaw, t)
+
+        lost = []
+        for marker_id, track in list(self.tracks.items()):
+            if marker_id not in seen:
+                track.missed += 1
+                if track.missed > TRACK_LOST_AFTER:
+                    del self.tracks[marker_id]
+                    lost.append(marker_id)
+                    changed = True
+                continue
+            if track.moved():
+                changed = True
+        return changed, lost
+
+    def markers(self):
+        out = []
+        for marker_id in sorted(self.tracks):
+            u, v, yaw = self.tracks[marker_id].published
+            out.append({
+                "id": marker_id,
+                "x": round(u, 1),
+                "y": round(v, 1),
+                "yaw": round(_wrap_deg(yaw), 1)
+            })
+        return out
+
+
+def run(frame_ring=None):
+    """frame_ring: name of a FrameRing shared with C (set by Main.py)."""
         # -------- Receive frames from C --------
     ctx = zmq.Context()
 
-    frame_sub = ctx.socket(zmq.SUB)
-    frame_sub.connect(f"tcp://localhost:{ZMQ_FRAME_PORT}")
-    frame_sub.setsockopt_string(zmq.SUBSCRIBE, "")
+    # Shared memory when C runs on this host, ZMQ otherwise
+    if frame_ring:
+        # C creates it with its first frame
+        frame_link = FrameRing.attach(frame_ring, link_name="C->A ring")
+    else:
+        frame_link = FrameSubLink(ctx, f"tcp://localhost:{ZMQ_FRAME_PORT}",
+                                  policy=FRAME_LINK_POLICY, name="C->A frames")
 
     # -------- Publish ArUco data to B --------
-    aruco_pub = ctx.socket(zmq.PUB)
-    aruco_pub.bind(f"tcp://*:{ZMQ_ARUCO_PORT}")
+    aruco_link = PubLink(ctx, f"tcp://*:{ZMQ_ARUCO_PORT}",
+                         policy=ARUCO_LINK_POLICY, name="A->B aruco")
 
 
-    params = np.load("camera_params.npz")
-    camera_matrix = params["camera_matrix"]
-    dist_coeffs = params["dist_coeffs"]
+    camera_matrix, dist_coeffs, maps = load_calibration()
+    undistort_maps = None
+    if UNDISTORT:
+        if maps is None:
+            print("UNDISTORT needs the calibration cache (TTT/CameraCalibration.py); disabled")
+        else:
+            undistort_maps = maps
 
     dict_aruco = cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_4X4_50)
     parameters = cv2.aruco.DetectorParameters()
     detector = cv2.aruco.ArucoDetector(dict_aruco, parameters)
+    tracker = MarkerTracker(detector) if ROI_TRACKING else None
 
     last_ids = None
     last_corners = None
-
+    prev_rvecs = {}   # id -> rvec of the last 3D pose (pnp mode)
+    tracks = TrackManager()
+    last_publish = None
 
     while True:
-        # Receive frame from C
-        frame = pickle.loads(frame_sub.recv())
+        # Receive the newest frame from C
+        frame, capture_ts = frame_link.recv_frame(timeout_ms=None)
+
+        pose_matrix, pose_dist = camera_matrix, dist_coeffs
+        if undistort_maps is not None:
+            map1, map2, new_camera_matrix, size = undistort_maps
+            if (frame.shape[1], frame.shape[0]) == size:
+                # Detect on the undistorted image: poses then use the new
+                # camera matrix and no distortion
+                frame = cv2.remap(frame, map1, map2, cv2.INTER_LINEAR)
+                pose_matrix, pose_dist = new_camera_matrix, None
+            else:
+                print(f"Frame size {frame.shape[1]}x{frame.shape[0]} does not match the "
+                      f"calibration {size[0]}x{size[1]}; undistortion disabled")
+                undistort_maps = None
 
         gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        corners, ids, _ = detector.detectMarkers(gray)
+        if tracker is not None:
+            corners, ids = tracker.detect(gray, capture_ts)
+        else:
+            corners, ids, _ = detector.detectMarkers(gray)
 
         # Found ArUco
+        detections = []
         if ids is not None:
-            half = MARKER_LENGTH / 2
-            obj_points = np.array([
-                [-half,  half, 0],
-                [ half,  half, 0],
-                [ half, -half, 0],
-                [-half, -half, 0]
-            ], dtype=np.float32)
-
-            all_rvecs = []
-            all_tvecs = []
-
-            for c in corners:
-                img_points = c[0].astype(np.float32)
-
-                ok, rvec, tvec = cv2.solvePnP(
-                    obj_points,
-                    img_points,
-                    camera_matrix,
-                    dist_coeffs,
-                    flags=cv2.SOLVEPNP_ITERATIVE
-                )
-
-                all_rvecs.append(rvec.reshape(3, 1))
-                all_tvecs.append(tvec.reshape(3, 1))
-
-            rvecs = all_rvecs
-            tvecs = all_tvecs
-
-            aruco_list = []
-            for i, marker_id in enumerate(ids.flatten()):
-                corner = corners[i][0]
-                u = float(np.mean(corner[:, 0]))
-                v = float(np.mean(corner[:, 1]))
-                r = rvecs[i]
-                yaw = get_yaw_from_rvec(r)
-
-                aruco_list.append({
-                    "id": int(marker_id),
-                    "x": round(u, 1),
-                    "y": round(v, 1),
-                    "yaw": round(float(yaw), 1)
-                })
-
-                print(
-                    f"[ID {marker_id}] "
-                    f"Pos: x={u:.1f}, y={v:.1f}  |  "
-                    f"Yaw={yaw:.1f}"
-                )
-
-            # Send to B
-            aruco_pub.send_pyobj(aruco_list)
-            print("----")
-
-
-            # Update cache
-            last_ids = ids
-            last_corners = corners
-
-        else:
-            #   Print disappearance info
-            if last_ids is not None:
-                for marker_id in last_ids.flatten():
-                    print(f"[ID {marker_id}] disappeared")
-                    aruco_pub.send_pyobj([])
-
-            # Clear cache (stop drawing)
-            last_ids = None
-            last_corners = None
+            if POSE_MODE == "fast":
+                poses = fast_poses(corners, pose_matrix, pose_dist)
+            else:
+                poses = pnp_poses(corners, ids, pose_matrix, pose_dist, prev_rvecs)
+            detections = [(int(marker_id), u, v, yaw)
+                          for marker_id, (u, v, yaw) in zip(ids.flatten(), poses)]
+
+        changed, lost = tracks.update(detections, capture_ts)
+        #   Print disappearance info
+        for marker_id in lost:
+            print(f"[ID {marker_id}] disappeared")
+
+        # Send to B when the tracked scene really changed, and resend it now
+        # and then so a B that starts later (or missed a message) catches up;
+        # B ignores a scene it already has
+        now = time.monotonic()
+        if changed or last_publish is None or now - last_publish >= SCENE_KEEPALIVE:
+            aruco_list = tracks.markers()
+            if changed:
+                for m in aruco_list:
+                    print(
+                        f"[ID {m['id']}] "
+                        f"Pos: x={m['x']:.1f}, y={m['y']:.1f}  |  "
+                        f"Yaw={m['yaw']:.1f}"
+                    )
+                print("----")
+            aruco_link.send_obj(aruco_list)
+            last_publish = now
+
+        # Update cache (None stops drawing)
+        last_ids = ids
+        last_corners = corners
 
         # Drawing Part
         if last_ids is not None:
@@ -128,8 +455,13 @@ def run():
         if cv2.waitKey(1) == 27:
             break
 
-    frame_sub.close()
-    aruco_pub.close()
+    if tracker is not None:
+        print(f"marker detection: full={tracker.full_scans} roi={tracker.roi_scans}")
+    print(frame_link.stats)
+    print(aruco_link.stats)
+
+    frame_link.close()
+    aruco_link.close()
     ctx.term()
 
     cv2.destroyAllWindows()
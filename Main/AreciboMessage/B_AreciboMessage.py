@@ -1,11 +1,25 @@
 import math
 import random
 import sys
+import time
+from collections import OrderedDict
 from typing import List, Tuple, Optional, Set
+import numpy as np
 import pygame
 
 import zmq
+from transport import LATEST, SubLink
+
+from .grid_stream import GridStreamer
+
 ZMQ_ARUCO_PORT = 5556
+ARUCO_LINK_POLICY = LATEST   # only the newest marker scene matters
+
+# grid_lit to Max (see grid_stream.py)
+OSC_HOST = "127.0.0.1"
+OSC_PORT = 8000
+GRID_CONTROL_PORT = 9002     # Max asks for a keyframe here
+GRID_KEYFRAME_INTERVAL = 2.0
 
 # ---------------- Config ----------------
 WIDTH, HEIGHT = 1200, 500
@@ -18,6 +32,8 @@ REFRACTIVE_INDEX_AIR = 1.0
 REFRACTIVE_INDEX_SHAPE = 1.5
 
 MAX_BOUNCES = 160
+MIN_RAY_ENERGY = 0.01         # rays/branches carrying less energy are pruned
+MAX_TRACE_SEGMENTS = 1000     # hard segment budget per trace call
 EPS = 1e-8
 TINY = 1e-4
 SAFE_INF = 1e18
@@ -42,7 +58,7 @@ GRID_COLS = WIDTH // GRID_SIZE
 GRID_ROWS = HEIGHT // GRID_SIZE
 
 # Grid lit boolean table: True = light has passed
-grid_lit = [[False for _ in range(GRID_ROWS)] for _ in range(GRID_COLS)]
+grid_lit = np.zeros((GRID_COLS, GRID_ROWS), dtype=bool)
 
 # ---------------- Vector utilities ----------------
 def v_add(a, b): return (a[0] + b[0], a[1] + b[1])
@@ -195,100 +211,609 @@ def generate_shapes(num_sq, num_tri, sq_size, tri_size, w, h, seed=None):
     return shapes
 
 # ---------------- Ray tracer ----------------
-def trace_ray(origin, direction, shapes):
-    out_segments = []
-    stack = [(origin, v_norm(direction), False)]   # (p, v, is_reflect_branch)
-
-    while stack:
-        p, v, is_reflect = stack.pop()
-
-        segments = []
-        v = v_norm(v)
-        if v == (0.0, 0.0):
-            continue
-
-        # Create edge list
-        edges = []
-        for pid, sh in enumerate(shapes):
+# Wavefront tracer: every active ray (including all sources and their
+# reflection branches) is advanced against every edge in one batched
+# NumPy step per bounce. The ray tree is recorded as it grows so the
+# segments can be emitted in the same order as a depth-first trace.
+# At B's six sources a bounce handles only a handful of rays, so its cost
+# is the number of NumPy calls, not their size; TTT/RayTest.py checks the
+# tracer against a scalar reference and times both.
+
+def shape_keys(shapes):
+    """Stable key per shape: (marker id, occurrence), used to match shapes
+    across configurations."""
+    keys = []
+    seen = {}
+    for sh in shapes:
+        key = sh.get("id")
+        n = seen.get(key, 0)
+        seen[key] = n + 1
+        keys.append((key, n))
+    return keys
+
+class Scene:
+    """Compiled, read-only geometry of one shape configuration.
+
+    Built once per new configuration (see shapes_from_aruco) and reused
+    by every tracer call: contiguous edge endpoints, outward normals,
+    owning shape ids, per-shape centroids and AABBs.
+    """
+
+    def __init__(self, shapes):
+        self.shapes = shapes
+        A, B, N, pid, starts, centers = [], [], [], [], [], []
+        for k, sh in enumerate(shapes):
             poly = sh["poly"]
+            starts.append(len(A))
+            # Same arithmetic as outward_normal, with the centroid hoisted
+            center = (sum(p[0] for p in poly) / len(poly), sum(p[1] for p in poly) / len(poly))
+            centers.append(center)
             for j in range(len(poly)):
                 a = poly[j]
                 b = poly[(j + 1) % len(poly)]
-                edges.append((a, b, pid))
-
-        # Initial inside check
-        inside_set = set()
-        for pid, sh in enumerate(shapes):
-            if point_in_poly(v_add(p, v_mul(v, TINY)), sh["poly"]):
-                inside_set.add(pid)
-
-        for _ in range(MAX_BOUNCES):
-            nearest_t = float("inf")
-            nearest_edge = None
-
-            # Find nearest intersection
-            for a, b, pid in edges:
-                res = ray_segment_intersection(p, v, a, b)
-                if res is None:
-                    continue
-                t, u = res
-                if t <= EPS or not (0 <= u <= 1):
+                mid = ((a[0] + b[0]) * 0.5, (a[1] + b[1]) * 0.5)
+                n = v_norm(perp(v_sub(b, a)))
+                if v_dot(n, v_sub(center, mid)) > 0:
+                    n = v_mul(n, -1.0)
+                A.append(a)
+                B.append(b)
+                N.append(n)
+                pid.append(k)
+
+        self.edge_a = np.array(A, dtype=np.float64).reshape(-1, 2)
+        self.edge_b = np.array(B, dtype=np.float64).reshape(-1, 2)
+        self.edge_normal = np.array(N, dtype=np.float64).reshape(-1, 2)
+        self.edge_shape = np.array(pid, dtype=np.intp)
+        self.shape_start = np.array(starts, dtype=np.intp)
+        self.centroid = np.array(centers, dtype=np.float64).reshape(-1, 2)
+        self.aabb = np.array([sh["aabb"] for sh in shapes], dtype=np.float64).reshape(-1, 4)
+        self.keys = shape_keys(shapes)
+        self.key_index = {key: k for k, key in enumerate(self.keys)}
+
+        # Column views used by the batched kernels
+        self.ax = self.edge_a[:, 0]; self.ay = self.edge_a[:, 1]
+        self.by = self.edge_b[:, 1]
+        S = self.edge_b - self.edge_a
+        self.sx = S[:, 0].copy(); self.sy = S[:, 1].copy()
+        # point_in_poly skips edges with a (near) horizontal span
+        self.slanted = np.abs(self.sy) >= 1e-12
+
+    @property
+    def num_edges(self):
+        return len(self.edge_shape)
+
+    @property
+    def num_shapes(self):
+        return len(self.shape_start)
+
+def compile_scene(shapes):
+    return shapes if isinstance(shapes, Scene) else Scene(shapes)
+
+def _dot_rows(a, b):
+    return a[:, 0] * b[:, 0] + a[:, 1] * b[:, 1]
+
+def _norm_rows(v):
+    L = np.hypot(v[:, 0], v[:, 1])
+    ok = L >= 1e-12
+    return np.where(ok[:, None], v / np.where(ok, L, 1.0)[:, None], 0.0)
+
+def _points_in_shapes(pts, scene):
+    """Even-odd test (as point_in_poly) of every point against every shape -> (N, S) bool."""
+    if scene.num_edges == 0:
+        return np.zeros((len(pts), 0), dtype=bool)
+    x = pts[:, 0:1]; y = pts[:, 1:2]
+    ay = scene.ay
+    straddle = ((ay > y) != (scene.by > y)) & scene.slanted
+    xint = scene.sx * (y - ay) / scene.sy + scene.ax
+    cross = straddle & (x < xint)
+    return np.bitwise_xor.reduceat(cross, scene.shape_start, axis=1)
+
+def _nearest_hits(P, V, scene):
+    """Nearest edge hit per ray (as ray_segment_intersection) -> (edge index, t).
+
+    t is inf for rays that hit nothing.
+    """
+    n = len(P)
+    if scene.num_edges == 0:
+        return np.zeros(n, dtype=np.intp), np.full(n, np.inf)
+    sx = scene.sx; sy = scene.sy
+    vx = V[:, 0:1]; vy = V[:, 1:2]
+    rxs = vx * sy - vy * sx
+    ap0 = scene.ax - P[:, 0:1]
+    ap1 = scene.ay - P[:, 1:2]
+    t = (ap0 * sy - ap1 * sx) / rxs
+    u = (ap0 * vy - ap1 * vx) / rxs
+    valid = (np.abs(rxs) >= 1e-12) & (t > EPS) & (u >= 0) & (u <= 1)
+    t = np.where(valid, t, np.inf)
+    j = np.argmin(t, axis=1)
+    return j, t[np.arange(n), j]
+
+def _refract_or_reflect_rows(v, n, d, n1, n2):
+    """Vectorized refract_or_reflect; d is the row-wise dot of n and v.
+
+    Returns (new unit directions, Fresnel reflectance for unpolarized
+    light; 1.0 on total internal reflection, unit mirror directions).
+    The mirror direction does not depend on the side n faces, so it is
+    also the direction of an external hit's reflection branch. v must be
+    unit rows; works on columns to keep the number of NumPy calls down.
+    """
+    vx = v[:, 0]; vy = v[:, 1]
+    # Flip n against v (multiplying by -1.0 is exact)
+    sign = np.where(d > 0, -1.0, 1.0)
+    nx = n[:, 0] * sign; ny = n[:, 1] * sign
+    vn = d * sign
+    cos_i = np.minimum(np.maximum(-vn, -1.0), 1.0)
+    ratio = n1 / n2
+    sin_t2 = ratio * ratio * np.maximum(0.0, 1.0 - cos_i * cos_i)
+    tir = sin_t2 > 1.0 - 1e-12
+    # Neither direction can be zero, so they are normalized without the
+    # guard of _norm_rows
+    k = 2.0 * vn
+    rx = vx - nx * k; ry = vy - ny * k
+    L = np.hypot(rx, ry)
+    refl = np.empty_like(v)
+    np.divide(rx, L, out=refl[:, 0]); np.divide(ry, L, out=refl[:, 1])
+    cos_t = np.sqrt(np.maximum(0.0, 1.0 - sin_t2))
+    k = ratio * cos_i - cos_t
+    tx = vx * ratio + nx * k; ty = vy * ratio + ny * k
+    L = np.hypot(tx, ty)
+    newv = np.empty_like(v)
+    np.divide(tx, L, out=newv[:, 0]); np.divide(ty, L, out=newv[:, 1])
+    newv[tir] = refl[tir]
+    a = n1 * cos_i; b = n2 * cos_t
+    rs = (a - b) / (a + b)
+    a = n1 * cos_t; b = n2 * cos_i
+    rp = (a - b) / (a + b)
+    R = np.minimum(0.5 * (rs * rs + rp * rp), 1.0)
+    R[tir] = 1.0
+    return newv, R, refl
+
+def _exit_point(p, v):
+    """End point where a ray that hits nothing leaves the padded screen."""
+    t_candidates = []
+    if abs(v[0]) > 1e-9:
+        t_candidates.append((WIDTH + 50 - p[0]) / v[0] if v[0] > 0 else (-50 - p[0]) / v[0])
+    if abs(v[1]) > 1e-9:
+        t_candidates.append((HEIGHT + 50 - p[1]) / v[1] if v[1] > 0 else (-50 - p[1]) / v[1])
+    t_candidates = [tc for tc in t_candidates if tc > 0]
+    if not t_candidates:
+        return None
+    return v_add(p, v_mul(v, min(t_candidates)))
+
+NO_SHAPES = frozenset()
+
+class Ray:
+    """One node of a traced ray tree.
+
+    A ray starts at origin with a fresh inside check and bounce budget
+    (like an entry popped off the original trace stack). segs are the
+    (start, end, inside, is_reflect) segments it produced; states[i] is
+    the (direction, keys of shapes it is inside, energy) it carried at
+    the start of segs[i], enough to resume tracing there. energy is the
+    fraction of its source's light the ray starts with. children are the
+    reflection branches it spawned, in push order, child_seg[k] the
+    segment whose end spawned children[k]. open_end is True when the
+    last segment ran off the screen without hitting anything.
+    """
+    __slots__ = ("origin", "direction", "is_reflect", "energy", "segs", "states",
+                 "children", "child_seg", "open_end")
+
+    def __init__(self, origin, direction, is_reflect=False, energy=1.0):
+        self.origin = origin
+        self.direction = direction
+        self.is_reflect = is_reflect
+        self.energy = energy
+        self.clear()
+
+    def clear(self, keep=0):
+        """Drop everything from segment keep onwards (0 = untraced)."""
+        if keep == 0:
+            self.segs = []
+            self.states = []
+            self.children = []
+            self.child_seg = []
+        else:
+            del self.segs[keep:]
+            del self.states[keep:]
+            n = sum(1 for i in self.child_seg if i < keep)
+            del self.children[n:]
+            del self.child_seg[n:]
+        self.open_end = False
+
+    def walk(self):
+        """Yield this ray and its descendants in depth-first trace order."""
+        stack = [self]
+        while stack:
+            r = stack.pop()
+            yield r
+            stack.extend(r.children)
+
+    def segments(self):
+        out = []
+        for r in self.walk():
+            out += r.segs
+        return out
+
+@np.errstate(divide="ignore", invalid="ignore")
+def trace_tree(rays, scene, resume=(), budget=MAX_TRACE_SEGMENTS):
+    """Trace a batch of Ray nodes in place, growing their subtrees.
+
+    rays are traced from their origin. resume holds already partly traced
+    rays, which continue from the state of their last dropped segment
+    (see Ray.clear) instead. Every active ray of every tree is advanced
+    together: one batched intersection step per bounce.
+
+    Each ray carries Fresnel-weighted energy: an external hit splits it
+    into a reflection branch (R) and the refracted ray (1 - R), an
+    internal hit keeps 1 - R (all of it on total internal reflection).
+    Rays and branches below MIN_RAY_ENERGY are dropped, and at most
+    budget segments are produced, the weakest rays being cut first.
+    """
+    scene = compile_scene(scene)
+    edge_pid = scene.edge_shape; edge_normal = scene.edge_normal
+    keys = scene.keys
+    table = []
+
+    # Per-ray state, one row per active ray: x, y, vx, vy, energy, bounces.
+    # Packed so the many small per-bounce selections are one indexing
+    # operation each; at a few dozen rays the per-call overhead of NumPy,
+    # not the arithmetic, is what a bounce costs.
+    # A new ray normalizes its direction and gets a fresh inside check
+    # and bounce budget, like a ray popped off trace_ray's stack.
+    rays = list(rays)
+    table.extend(rays)
+    S = np.zeros((len(rays), 6), dtype=np.float64)
+    S[:, 0:2] = np.array([r.origin for r in rays], dtype=np.float64).reshape(-1, 2)
+    S[:, 2:4] = _norm_rows(np.array([r.direction for r in rays], dtype=np.float64).reshape(-1, 2))
+    S[:, 4] = [r.energy for r in rays]
+    live = (S[:, 2] != 0.0) | (S[:, 3] != 0.0)
+    ids = np.flatnonzero(live)
+    S = S[live]
+    inside = _points_in_shapes(S[:, 0:2] + S[:, 2:4] * TINY, scene)
+
+    if resume:
+        # Pick up where the kept segments left off
+        r_S, r_in = [], []
+        for r, (p, v, in_keys, e, b) in resume:
+            r_S.append((p[0], p[1], v[0], v[1], e, b))
+            row = np.zeros(len(keys), dtype=bool)
+            for key in in_keys:
+                k = scene.key_index.get(key)
+                if k is not None:
+                    row[k] = True
+            r_in.append(row)
+        first = len(table)
+        table.extend(r for r, _ in resume)
+        ids = np.concatenate([ids, np.arange(first, len(table), dtype=np.intp)])
+        S = np.concatenate([S, np.array(r_S, dtype=np.float64)])
+        inside = np.concatenate([inside, np.array(r_in, dtype=bool).reshape(-1, len(keys))])
+
+    emitted = 0
+    while len(ids):
+        # Segment budget: keep the strongest rays when this bounce would overrun it
+        room = budget - emitted
+        if room <= 0:
+            break
+        if len(ids) > room:
+            keep = np.sort(np.argsort(-S[:, 4], kind="stable")[:room])
+            ids, S, inside = ids[keep], S[keep], inside[keep]
+        emitted += len(ids)
+
+        P = S[:, 0:2]; V = S[:, 2:4]
+        j, t = _nearest_hits(P, V, scene)
+        # Rays that hit nothing get t = inf; their rows below hold junk
+        # and are dropped at the end of the bounce
+        hit = t < np.inf
+        inter = P + V * t[:, None]
+        # Keys of the shapes each ray is inside, from one nonzero() call
+        in_sets = [[] for _ in range(len(ids))]
+        for r, c in zip(*np.nonzero(inside)):
+            in_sets[r].append(keys[c])
+        in_keys = [frozenset(ks) if ks else NO_SHAPES for ks in in_sets]
+        nodes = [table[r] for r in ids.tolist()]
+
+        for ray, row, q, h, ik in zip(nodes, S.tolist(), inter.tolist(), hit.tolist(), in_keys):
+            p = (row[0], row[1]); v = (row[2], row[3])
+            ins = ik is not NO_SHAPES
+            if h:
+                ray.segs.append((p, tuple(q), ins, ray.is_reflect))
+            else:
+                # Leaves the screen
+                endp = _exit_point(p, v)
+                if endp is None:
                     continue
-                if t < nearest_t:
-                    nearest_t = t
-                    nearest_edge = (a, b, pid)
-
-            # Out of bounds check
-            if nearest_edge is None:
-                t_candidates = []
-                if abs(v[0]) > 1e-9:
-                    t_candidates.append((WIDTH + 50 - p[0]) / v[0] if v[0] > 0 else (-50 - p[0]) / v[0])
-                if abs(v[1]) > 1e-9:
-                    t_candidates.append((HEIGHT + 50 - p[1]) / v[1] if v[1] > 0 else (-50 - p[1]) / v[1])
-
-                if t_candidates:
-                    t_exit = min(tc for tc in t_candidates if tc > 0)
-                    endp = v_add(p, v_mul(v, t_exit))
-                    segments.append((p, endp, len(inside_set) > 0, is_reflect))
-                break
-
-            # The nearest intersection found
-            a, b, pid = nearest_edge
-            inter = v_add(p, v_mul(v, nearest_t))
-            segments.append((p, inter, len(inside_set) > 0, is_reflect))
-
-            was_inside = point_in_poly(v_sub(inter, v_mul(v, TINY)), shapes[pid]["poly"])
-            n1 = REFRACTIVE_INDEX_SHAPE if was_inside else REFRACTIVE_INDEX_AIR
-            n2 = REFRACTIVE_INDEX_AIR if was_inside else REFRACTIVE_INDEX_SHAPE
-
-            nvec = outward_normal(a, b, shapes[pid]["poly"])
-
-            # Snell's law
-            mode, newv = refract_or_reflect(v, nvec, n1, n2)
-
-            # Reflection splitting
-            if not was_inside:  
-                refl_dir = v_sub(v, v_mul(nvec, 2 * v_dot(v, nvec)))
-                refl_dir = v_norm(refl_dir)
-                stack.append((v_add(inter, v_mul(refl_dir, TINY)), refl_dir, True))
-
-            # Refraction or total internal reflection
-            p = v_add(inter, v_mul(newv, TINY))
-            v = newv
-
-            # Update inside
-            if point_in_poly(v_add(inter, v_mul(v, TINY)), shapes[pid]["poly"]):
-                inside_set.add(pid)
+                ray.segs.append((p, endp, ins, ray.is_reflect))
+                ray.open_end = True
+            ray.states.append((v, ik, row[4]))
+        if not hit.any():
+            break
+
+        pid = edge_pid[j]
+        rows = np.arange(len(ids))
+        # A ray leaving through an edge moves along its outward normal.
+        # Same answer as testing a point just before the hit, without a
+        # point-in-polygon pass
+        nvec = edge_normal[j]
+        d = nvec[:, 0] * V[:, 0] + nvec[:, 1] * V[:, 1]
+        was_inside = d > 0
+        n1 = np.where(was_inside, REFRACTIVE_INDEX_SHAPE, REFRACTIVE_INDEX_AIR)
+        n2 = np.where(was_inside, REFRACTIVE_INDEX_AIR, REFRACTIVE_INDEX_SHAPE)
+
+        newv, R, refl = _refract_or_reflect_rows(V, nvec, d, n1, n2)
+        energy = S[:, 4]
+        c_energy = energy * R
+        # Total internal reflection keeps everything; otherwise the ray
+        # goes on with the transmitted share
+        energy = np.where(R >= 1.0, energy, energy * (1.0 - R))
+
+        # Refraction or total internal reflection, updating the state in
+        # place; the continuing ray is inside the hit shape when it now
+        # heads against the outward normal
+        inside[rows, pid] = (nvec[:, 0] * newv[:, 0] + nvec[:, 1] * newv[:, 1]) < 0
+        np.add(inter, newv * TINY, out=S[:, 0:2])
+        S[:, 2:4] = newv
+        S[:, 4] = energy
+        S[:, 5] += 1.0
+        keep = (hit &
+                (S[:, 0] >= -200) & (S[:, 0] <= WIDTH + 200) &
+                (S[:, 1] >= -200) & (S[:, 1] <= HEIGHT + 200) &
+                (S[:, 5] < MAX_BOUNCES) & (energy >= MIN_RAY_ENERGY))
+
+        # Reflection splitting on external hits
+        ext = np.flatnonzero(hit & ~was_inside & (c_energy >= MIN_RAY_ENERGY))
+        if not len(ext):
+            ids, S, inside = ids[keep], S[keep], inside[keep]
+            continue
+        refl = refl[ext]
+        c_origin = inter[ext] + refl * TINY
+        c_E = c_energy[ext]
+        first = len(table)
+        for k, o, dv, e in zip(ext.tolist(), c_origin.tolist(), refl.tolist(), c_E.tolist()):
+            child = Ray(tuple(o), tuple(dv), True, e)
+            parent = nodes[k]
+            parent.children.append(child)
+            parent.child_seg.append(len(parent.segs) - 1)
+            table.append(child)
+        # Branch directions are renormalized like any new ray's, and
+        # branches get a full inside check
+        c_S = np.zeros((len(ext), 6))
+        c_S[:, 0:2] = c_origin
+        c_S[:, 2:4] = _norm_rows(refl)
+        c_S[:, 4] = c_E
+        c_inside = _points_in_shapes(c_origin + c_S[:, 2:4] * TINY, scene)
+        ids = np.concatenate([ids[keep], np.arange(first, len(table), dtype=np.intp)])
+        S = np.concatenate([S[keep], c_S])
+        inside = np.concatenate([inside[keep], c_inside])
+
+    return rays
+
+def trace_rays(origins, directions, scene):
+    """Trace several sources at once; returns one segment list per source.
+
+    scene is a compiled Scene (a plain shape list is compiled on the fly).
+    Each segment is (start, end, inside, is_reflect), the same segments
+    trace_ray produces for each source on its own.
+    """
+    roots = [Ray(o, v_norm(d)) for o, d in zip(origins, directions)]
+    trace_tree(roots, scene)
+    return [r.segments() for r in roots]
+
+def trace_ray(origin, direction, scene):
+    return trace_rays([origin], [direction], scene)[0]
+
+# ---------------- Incremental re-tracing ----------------
+AABB_MARGIN = 1.0   # "passed near" slack around a changed shape's box (px)
+
+def changed_boxes(old_shapes, new_shapes):
+    """AABBs (old and new) of every shape that moved, appeared or vanished.
+
+    Shapes are matched by marker id; an unmatched shape counts as changed.
+    """
+    old = dict(zip(shape_keys(old_shapes), old_shapes))
+    new = dict(zip(shape_keys(new_shapes), new_shapes))
+    boxes = []
+    for key in old.keys() | new.keys():
+        a = old.get(key); b = new.get(key)
+        if a is not None and b is not None and a["poly"] == b["poly"]:
+            continue
+        if a is not None:
+            boxes.append(a["aabb"])
+        if b is not None:
+            boxes.append(b["aabb"])
+    return boxes
+
+def _segments_cross_boxes(seg_a, seg_b, open_end, boxes):
+    """Slab test of segments against boxes -> bool per segment.
+
+    Segments flagged open_end are treated as rays that continue past b.
+    """
+    box = np.array(boxes, dtype=np.float64).reshape(-1, 4)
+    lo = box[:, 0:2] - AABB_MARGIN
+    hi = box[:, 2:4] + AABB_MARGIN
+    d = seg_b - seg_a
+    t0 = np.zeros((len(seg_a), len(box)))
+    t1 = np.where(open_end, np.inf, 1.0)[:, None] + t0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for ax in (0, 1):
+            p = seg_a[:, ax:ax + 1]; v = d[:, ax:ax + 1]
+            flat = np.abs(v) < 1e-12
+            ta = (lo[:, ax] - p) / v
+            tb = (hi[:, ax] - p) / v
+            near = np.where(flat, -np.inf, np.minimum(ta, tb))
+            far = np.where(flat, np.inf, np.maximum(ta, tb))
+            # A segment parallel to this axis must already lie within the slab
+            outside = flat & ((p < lo[:, ax]) | (p > hi[:, ax]))
+            t0 = np.maximum(t0, near)
+            t1 = np.where(outside, -np.inf, np.minimum(t1, far))
+    return (t0 <= t1).any(axis=1)
+
+class IncrementalTracer:
+    """Keeps per-source ray trees and re-traces only what a change touches.
+
+    When shapes move, each ray is cut at its first segment that crosses
+    (or passes within AABB_MARGIN of) the old or new AABB of a changed
+    shape and resumed from there; the reflection branches it spawned
+    from that point on are re-traced with it, everything else is kept.
+    The tracer's own lit grid (self.lit) is maintained as per-cell
+    coverage counts so only the cells of dropped and re-traced segments
+    are updated.
+    """
+
+    def __init__(self, sources, directions):
+        self.roots = [Ray(o, v_norm(d)) for o, d in zip(sources, directions)]
+        self.scene = Scene([])
+        self.cover = np.zeros((GRID_COLS, GRID_ROWS), dtype=np.int32)
+        self.lit = np.zeros((GRID_COLS, GRID_ROWS), dtype=bool)
+        self.retraced = 0   # segments produced by the last update
+        trace_tree(self.roots, self.scene)
+        for r in self.roots:
+            self._cover(r.segments(), 1)
+
+    def rays(self):
+        return [r.segments() for r in self.roots]
+
+    def update(self, scene):
+        """Switch to a new compiled scene, re-tracing only affected subtrees."""
+        boxes = changed_boxes(self.scene.shapes, scene.shapes)
+        self.scene = scene
+        self.retraced = 0
+        if not boxes:
+            return
+
+        # First affected segment of every ray
+        nodes = [n for r in self.roots for n in r.walk()]
+        owner, index, seg_a, seg_b, open_end = [], [], [], [], []
+        for k, n in enumerate(nodes):
+            for i, seg in enumerate(n.segs):
+                owner.append(k)
+                index.append(i)
+                seg_a.append(seg[0])
+                seg_b.append(seg[1])
+                open_end.append(n.open_end and i == len(n.segs) - 1)
+        first = {}
+        if owner:
+            crossed = _segments_cross_boxes(np.array(seg_a, dtype=np.float64),
+                                            np.array(seg_b, dtype=np.float64),
+                                            np.array(open_end), boxes)
+            for k, i in zip(np.array(owner)[crossed].tolist(), np.array(index)[crossed].tolist()):
+                if first.get(k, i) >= i:
+                    first[k] = i
+        # A ray starting next to a changed shape needs a fresh inside check
+        orig = np.array([n.origin for n in nodes], dtype=np.float64)
+        near = _segments_cross_boxes(orig, orig, np.zeros(len(nodes), dtype=bool), boxes)
+        for k in np.flatnonzero(near).tolist():
+            first[k] = 0
+        first = {id(nodes[k]): i for k, i in first.items()}
+
+        # Cut each affected ray at its first affected segment; branches it
+        # spawned before that point are checked on their own.
+        fresh, resume, cut = [], [], []
+        stack = list(self.roots)
+        while stack:
+            n = stack.pop()
+            i = first.get(id(n))
+            if i is None:
+                stack.extend(n.children)
+                continue
+            self._cover(self._tail(n, i), -1)
+            stack.extend(c for c, j in zip(n.children, n.child_seg) if j < i)
+            if i == 0:
+                n.clear()
+                fresh.append(n)
             else:
-                inside_set.discard(pid)
-
-            # If the light is too far out of bounds, stop
-            if p[0] < -200 or p[0] > WIDTH + 200 or p[1] < -200 or p[1] > HEIGHT + 200:
-                break
-
-        out_segments += segments
-
-    return out_segments
+                v, in_keys, e = n.states[i]
+                resume.append((n, (n.segs[i][0], v, in_keys, e, i)))
+                n.clear(i)
+            cut.append((n, i))
+        if not cut:
+            return
+
+        # The segment budget covers the whole forest, kept segments included
+        kept = sum(len(n.segs) for r in self.roots for n in r.walk())
+        trace_tree(fresh, scene, resume, budget=max(0, MAX_TRACE_SEGMENTS - kept))
+        for n, i in cut:
+            segs = self._tail(n, i)
+            self._cover(segs, 1)
+            self.retraced += len(segs)
+
+    @staticmethod
+    def _tail(ray, i):
+        """Segments of ray from segs[i] on, plus the subtrees spawned there."""
+        out = list(ray.segs[i:])
+        for c, j in zip(ray.children, ray.child_seg):
+            if j >= i:
+                out += c.segments()
+        return out
+
+    def _cover(self, segs, delta):
+        if not segs:
+            return
+        self.cover += delta * segments_cover(segs)
+        np.greater(self.cover, 0, out=self.lit)
+
+# ---------------- Trace cache ----------------
+CACHE_SIZE = 64          # scenes kept
+CACHE_XY_STEP = 2.0      # camera px; marker positions are snapped to this
+CACHE_YAW_STEP = 1.0     # degrees; marker yaw is snapped to this
+
+def _snap(value, step):
+    if step <= 0:
+        return value, value
+    q = round(value / step)
+    return q, round(q * step, 6)
+
+def quantize_aruco(aruco_list, xy_step=CACHE_XY_STEP, yaw_step=CACHE_YAW_STEP):
+    """Snap marker poses to the cache grid.
+
+    Returns (key, markers): a hashable key of the quantized scene and the
+    snapped markers (sorted by id) to build the shapes from, so every
+    pose that maps to the same key produces exactly the same scene.
+    """
+    key = []
+    markers = []
+    for item in sorted(aruco_list, key=lambda m: m["id"]):
+        qx, x = _snap(item["x"], xy_step)
+        qy, y = _snap(item["y"], xy_step)
+        qa, yaw = _snap(item["yaw"], yaw_step)
+        key.append((item["id"], qx, qy, qa))
+        markers.append({"id": item["id"], "x": x, "y": y, "yaw": yaw})
+    return tuple(key), markers
+
+class TraceCache:
+    """LRU cache of (segments, lit grid) per quantized scene."""
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, all_rays, lit):
+        self.entries[key] = (all_rays, lit.copy())
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self.entries),
+            "hit_rate": self.hits / total if total else 0.0,
+        }
 
 # ---------------- Drawing ----------------
 def safe_draw_circle(surface, color, point, radius):
@@ -298,64 +823,138 @@ def safe_draw_circle(surface, color, point, radius):
         except:
             pass
 
-def mark_segment_on_grid(a, b):
-    x1, y1 = a; x2, y2 = b
+# Cell centres, laid out like grid_lit ([cx, cy]) and flattened
+_CELL_X, _CELL_Y = np.meshgrid(np.arange(GRID_COLS) * GRID_SIZE + GRID_SIZE * 0.5,
+                               np.arange(GRID_ROWS) * GRID_SIZE + GRID_SIZE * 0.5,
+                               indexing="ij")
+_CELL_X = _CELL_X.ravel()[None, :]
+_CELL_Y = _CELL_Y.ravel()[None, :]
+LIT_RADIUS2 = (GRID_SIZE * 0.48) ** 2
+COVER_CHUNK = 256   # segments per vectorized distance pass
+
+def segments_cover(segs):
+    """Count, per grid cell, the segments passing close to its centre.
+
+    A segment lights a cell when the cell centre lies within
+    0.48·GRID_SIZE of it (the original center-point projection rule),
+    evaluated for all segments and cells in one vectorized pass.
+    Segments with non-finite endpoints are skipped.
+    Returns an int32 array shaped like grid_lit.
+    """
+    counts = np.zeros(GRID_COLS * GRID_ROWS, dtype=np.int32)
+    pts = np.array([(a[0], a[1], b[0], b[1]) for a, b, *_ in segs], dtype=np.float64).reshape(-1, 4)
+    pts = pts[np.isfinite(pts).all(axis=1)]
 
     # Then order of points
-    if x1 > x2:
-        x1, x2 = x2, x1
-        y1, y2 = y2, y1
-
-    # Bounding box → reduce computation
-    min_c = max(0, int(min(x1, x2) // GRID_SIZE))
-    max_c = min(GRID_COLS - 1, int(max(x1, x2) // GRID_SIZE))
-    min_r = max(0, int(min(y1, y2) // GRID_SIZE))
-    max_r = min(GRID_ROWS - 1, int(max(y1, y2) // GRID_SIZE))
-
-    # Center point projection method
-    for cx in range(min_c, max_c + 1):
-        for cy in range(min_r, max_r + 1):
-            gx = cx * GRID_SIZE + GRID_SIZE * 0.5
-            gy = cy * GRID_SIZE + GRID_SIZE * 0.5
-
-            # Judge if the line segment is close enough to the grid cell center
-            # If < GRID_SIZE/2, consider the light passing through the cell
-            px, py = gx, gy
-            vx, vy = x2 - x1, y2 - y1
-            wx, wy = px - x1, py - y1
-            L2 = vx * vx + vy * vy
-            if L2 < 1e-12:
-                continue
-            t = max(0.0, min(1.0, (wx * vx + wy * vy) / L2))
-            projx = x1 + vx * t
-            projy = y1 + vy * t
-            dx = px - projx; dy = py - projy
-            if dx * dx + dy * dy <= (GRID_SIZE * 0.48) ** 2:
-                grid_lit[cx][cy] = True
-
-def draw_scene(screen, shapes, all_rays, show_debug):
-    screen.fill(BG)
+    swap = pts[:, 0] > pts[:, 2]
+    pts[swap] = pts[swap][:, [2, 3, 0, 1]]
+    vx = pts[:, 2] - pts[:, 0]; vy = pts[:, 3] - pts[:, 1]
+    L2 = vx * vx + vy * vy
+    ok = L2 >= 1e-12
+    pts, vx, vy, L2 = pts[ok], vx[ok], vy[ok], L2[ok]
+
+    for k in range(0, len(pts), COVER_CHUNK):
+        x1 = pts[k:k + COVER_CHUNK, 0:1]; y1 = pts[k:k + COVER_CHUNK, 1:2]
+        cvx = vx[k:k + COVER_CHUNK, None]; cvy = vy[k:k + COVER_CHUNK, None]
+        wx = _CELL_X - x1; wy = _CELL_Y - y1
+        t = np.maximum(0.0, np.minimum(1.0, (wx * cvx + wy * cvy) / L2[k:k + COVER_CHUNK, None]))
+        dx = _CELL_X - (x1 + cvx * t); dy = _CELL_Y - (y1 + cvy * t)
+        counts += (dx * dx + dy * dy <= LIT_RADIUS2).sum(axis=0, dtype=np.int32)
+    return counts.reshape(GRID_COLS, GRID_ROWS)
+
+def ray_color(from_right, inside, is_reflect):
+    if from_right:
+        if is_reflect:
+            return COL_REFLECT_RIGHT
+        return COL_INSIDE_RIGHT if inside else COL_AIR_RIGHT
+    if is_reflect:
+        return COL_REFLECT_LEFT
+    return COL_INSIDE_LEFT if inside else COL_AIR_LEFT
+
+class SceneRenderer:
+    """Retained-mode renderer: grid, shape and ray layers are cached.
+
+    set_scene() and set_debug() only mark layers stale; draw() rebuilds
+    the stale ones, composes and flips, and does nothing at all when
+    nothing changed since the last frame.
+    """
+
+    def __init__(self, screen):
+        self.screen = screen
+        self.shapes = []
+        self.all_rays = []
+        self.lit = np.zeros((GRID_COLS, GRID_ROWS), dtype=bool)
+        self.show_debug = False
+
+        # Grid: one pixel per cell, scaled up to GRID_SIZE
+        self.grid_small = pygame.Surface((GRID_COLS, GRID_ROWS))
+        self.grid_layer = pygame.Surface((GRID_COLS * GRID_SIZE, GRID_ROWS * GRID_SIZE))
+        self.grid_rgb = np.zeros((GRID_COLS, GRID_ROWS, 3), dtype=np.uint8)
+        self.shape_layer = pygame.Surface((WIDTH, HEIGHT), pygame.SRCALPHA)
+        self.ray_layer = pygame.Surface((WIDTH, HEIGHT), pygame.SRCALPHA)
+
+        self.grid_stale = True
+        self.debug_stale = True
+        self.dirty = True
+
+    def set_scene(self, shapes, all_rays, lit):
+        self.shapes = shapes
+        self.all_rays = all_rays
+        self.lit = lit.copy()
+        self.grid_stale = True
+        self.debug_stale = True
+        self.dirty = True
+
+    def set_debug(self, show_debug):
+        if show_debug != self.show_debug:
+            self.show_debug = show_debug
+            self.dirty = True
+
+    def invalidate(self):
+        """Force a redraw, e.g. after the window was exposed."""
+        self.dirty = True
+
+    def draw(self):
+        if not self.dirty:
+            return False
+        if self.grid_stale:
+            self._build_grid()
+        if self.show_debug and self.debug_stale:
+            self._build_shapes()
+            self._build_rays()
+
+        self.screen.fill(BG)
+        self.screen.blit(self.grid_layer, (0, 0))
+        if self.show_debug:
+            self.screen.blit(self.shape_layer, (0, 0))
+            self.screen.blit(self.ray_layer, (0, 0))
+        pygame.display.flip()
+        self.dirty = False
+        return True
+
     # --------- Draw grid background: lit cells white, dark cells black ----------
-    for cx in range(GRID_COLS):
-        for cy in range(GRID_ROWS):
-            color = (255, 255, 255) if grid_lit[cx][cy] else (0, 0, 0)
-            pygame.draw.rect(
-                screen, color,
-                pygame.Rect(cx * GRID_SIZE, cy * GRID_SIZE, GRID_SIZE, GRID_SIZE)
-            )
-    if show_debug:
-        # --------- Draw the shapes ----------
-        alpha_surf = pygame.Surface((WIDTH, HEIGHT), pygame.SRCALPHA)
-        for sh in shapes:
-            pygame.draw.polygon(alpha_surf, COL_FILL, sh["poly"])
-        screen.blit(alpha_surf, (0, 0))
-
-        for sh in shapes:
+    def _build_grid(self):
+        self.grid_rgb[:] = 0
+        self.grid_rgb[self.lit] = 255
+        pygame.surfarray.blit_array(self.grid_small, self.grid_rgb)
+        pygame.transform.scale(self.grid_small, self.grid_layer.get_size(), self.grid_layer)
+        self.grid_stale = False
+
+    # --------- Draw the shapes ----------
+    def _build_shapes(self):
+        surf = self.shape_layer
+        surf.fill((0, 0, 0, 0))
+        for sh in self.shapes:
+            pygame.draw.polygon(surf, COL_FILL, sh["poly"])
+        for sh in self.shapes:
             col = COL_SQ_EDGE if sh["is_square"] else COL_TRI_EDGE
-            pygame.draw.polygon(screen, col, sh["poly"], 2)
+            pygame.draw.polygon(surf, col, sh["poly"], 2)
 
-        # --------- Draw the rays ----------
-        for segs in all_rays:
+    # --------- Draw the rays ----------
+    def _build_rays(self):
+        surf = self.ray_layer
+        surf.fill((0, 0, 0, 0))
+        for segs in self.all_rays:
             if not segs:
                 continue
 
@@ -366,23 +965,10 @@ def draw_scene(screen, shapes, all_rays, show_debug):
             for a, b, inside, is_reflect in segs:
                 if not is_valid_point(a) or not is_valid_point(b):
                     continue
-
-                if from_right:
-                    if is_reflect:
-                        col = COL_REFLECT_RIGHT
-                    else:
-                        col = COL_INSIDE_RIGHT if inside else COL_AIR_RIGHT
-                else:
-                    if is_reflect:
-                        col = COL_REFLECT_LEFT
-                    else:
-                        col = COL_INSIDE_LEFT if inside else COL_AIR_LEFT
-
-                pygame.draw.line(screen, col, a, b, 3)
-                safe_draw_circle(screen, col, b, 3)
-
-    pygame.display.flip()
-
+                col = ray_color(from_right, inside, is_reflect)
+                pygame.draw.line(surf, col, a, b, 3)
+                safe_draw_circle(surf, col, b, 3)
+        self.debug_stale = False
 
 # ---------- ArUco → Screen mapping ----------
 CAM_W = 640     # The camera resolution used in A
@@ -414,6 +1000,7 @@ def shapes_from_aruco(aruco_list):
             continue
 
         shapes.append({
+            "id": marker_id,
             "poly": poly,
             "aabb": poly_aabb(poly),
             "is_square": is_square
@@ -421,6 +1008,9 @@ def shapes_from_aruco(aruco_list):
 
     return shapes
 
+# ---------------- Frame pacing ----------------
+FPS = 60
+
 # ---------------- Main ----------------
 def run():
     pygame.init()
@@ -428,12 +1018,18 @@ def run():
     pygame.display.set_caption("AreciboMessage")
 
     context = zmq.Context()
-    aruco_sub = context.socket(zmq.SUB)
-    aruco_sub.connect("tcp://127.0.0.1:5556")  # Stay consistent with A
-    aruco_sub.setsockopt_string(zmq.SUBSCRIBE, "")
-    aruco_sub.RCVTIMEO = 1   # Non-blocking
+    aruco_link = SubLink(context, f"tcp://127.0.0.1:{ZMQ_ARUCO_PORT}",  # Stay consistent with A
+                         policy=ARUCO_LINK_POLICY, name="A->B aruco")
+
+    grid_stream = GridStreamer(OSC_HOST, OSC_PORT, control_port=GRID_CONTROL_PORT,
+                               keyframe_interval=GRID_KEYFRAME_INTERVAL)
+
+    # Wake up on a new message or when the next frame is due
+    poller = zmq.Poller()
+    poller.register(aruco_link.socket, zmq.POLLIN)
 
     shapes = []
+    scene_key = ()
     show_debug = False   # Boolean to show rays or not
 
     # Rays on the left side
@@ -452,12 +1048,48 @@ def run():
 
     sources = left_sources + right_sources
 
-    clock = pygame.time.Clock()
+    directions = []
+    for sx, sy in sources:
+        if sx < WIDTH * 0.5:
+            directions.append((1.0, 0.0))
+        else:
+            directions.append((-1.0, 0.0))
+
+    # Per-source ray trees, kept across updates
+    tracer = IncrementalTracer(sources, directions)
+    # Results of recently seen (quantized) configurations
+    trace_cache = TraceCache()
+    renderer = SceneRenderer(screen)
+
+    frame_interval = 1.0 / FPS
+    next_frame = time.monotonic()
     running = True
     recompute = True
-    all_rays = []
+    all_rays = tracer.rays()
 
     while running:
+        if aruco_link.pending():
+            timeout_ms = 0
+        else:
+            timeout_ms = max(0, math.ceil((next_frame - time.monotonic()) * 1000.0))
+        events = dict(poller.poll(timeout_ms))
+
+        # -------- ZMQ receive aruco data --------
+        # Newest scene only by default; queued policies hand out one per pass
+        if aruco_link.socket in events or aruco_link.pending():
+            aruco_list = aruco_link.recv_obj()
+            if isinstance(aruco_list, list):
+                key, markers = quantize_aruco(aruco_list)
+                # Jitter below the quantization steps is not a new scene
+                if key != scene_key:
+                    scene_key = key
+                    shapes = shapes_from_aruco(markers)
+                    recompute = True
+
+        if time.monotonic() < next_frame and not recompute:
+            continue
+        next_frame = max(next_frame + frame_interval, time.monotonic())
+
         for ev in pygame.event.get(): 
             if ev.type == pygame.QUIT: 
                 running = False 
@@ -466,48 +1098,37 @@ def run():
                     running = False
                 elif ev.key == pygame.K_r:
                     show_debug = not show_debug
-
-        # -------- ZMQ receive aruco data --------
-        try:
-            aruco_list = aruco_sub.recv_pyobj()
-            if isinstance(aruco_list, list):
-                shapes = shapes_from_aruco(aruco_list)
-                recompute = True
-        except zmq.Again:
-            pass
+            elif ev.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                renderer.invalidate()
 
         if recompute:
-            # Reset grid lit
-            for cx in range(GRID_COLS):
-                for cy in range(GRID_ROWS):
-                    grid_lit[cx][cy] = False
-
-            all_rays = []
-            for sx, sy in sources:
-                if sx < WIDTH * 0.5:
-                    direction = (1.0, 0.0)
-                else:
-                    direction = (-1.0, 0.0)
-                rays = trace_ray((sx, sy), direction, shapes)
-                all_rays.append(rays)
-
-                # Mark all grid cells
-                for seg in rays:
-                    if not isinstance(seg, (tuple, list)):
-                        continue
-                    if len(seg) < 3:
-                        continue
-
-                    a, b, inside = seg[:3]
-                    if is_valid_point(a) and is_valid_point(b):
-                        mark_segment_on_grid(a, b)
-
+            cached = trace_cache.get(scene_key)
+            if cached is None:
+                # Compile the geometry once per configuration; only subtrees
+                # touching a changed shape are re-traced
+                tracer.update(Scene(shapes))
+                all_rays = tracer.rays()
+                lit = tracer.lit
+                trace_cache.put(scene_key, all_rays, lit)
+            else:
+                all_rays, lit = cached
+            grid_lit[:] = lit
+            renderer.set_scene(shapes, all_rays, grid_lit)
             recompute = False
 
-        draw_scene(screen, shapes, all_rays, show_debug)
-        clock.tick(60)
+        # Deltas when the grid changed, plus periodic/requested keyframes
+        grid_stream.publish(grid_lit)
+
+        # Redraws only when the scene or show_debug changed
+        renderer.set_debug(show_debug)
+        renderer.draw()
+
+    print("trace cache:", trace_cache.stats())
+    print(aruco_link.stats)
+    print("grid stream:", grid_stream.stats())
 
-    aruco_sub.close()
+    grid_stream.close()
+    aruco_link.close()
     context.term()
 
     pygame.quit()
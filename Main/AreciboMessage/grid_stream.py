@@ -0,0 +1,105 @@
+"""Stream the lit grid of B to Max over OSC.
+
+The grid is bit-packed (np.packbits, cells in grid_lit order, i.e.
+column-major on screen) and sent as
+    /grid/key   seq cols rows density blob   full grid
+    /grid/delta seq density blob             changed cells only
+A delta's blob holds the indices of the cells that flipped since the
+previous message, as little-endian uint16; apply them to the grid of
+message seq - 1. Keyframes go out every keyframe_interval seconds, when
+a delta would not be smaller, and on request. density is the lit
+fraction of the grid (0-1).
+
+A receiver that sees a gap in seq sends /grid/keyframe to the control
+port and ignores deltas until the next keyframe.
+"""
+import threading
+import time
+
+import numpy as np
+from pythonosc.dispatcher import Dispatcher
+from pythonosc.osc_server import BlockingOSCUDPServer
+from pythonosc.udp_client import SimpleUDPClient
+
+
+class GridStreamer:
+    """Publish grid_lit as keyframes and deltas.
+
+    Methods
+    - publish(grid): call once per frame; sends only when the grid changed
+      or a keyframe is due
+    - close()
+    """
+
+    def __init__(self, host="127.0.0.1", port=8000, control_port=9002, keyframe_interval=2.0):
+        self.client = SimpleUDPClient(host, port)
+        self.keyframe_interval = keyframe_interval
+        self.seq = 0
+        self.keyframes = 0
+        self.deltas = 0
+        self.bytes = 0
+        self._last = None              # grid as last sent, flattened
+        self._last_key = 0.0
+        self._key_requested = False
+        self._server = None
+        if control_port:
+            dispatcher = Dispatcher()
+            dispatcher.map("/grid/keyframe", self._on_keyframe_request)
+            self._server = BlockingOSCUDPServer(("127.0.0.1", control_port), dispatcher)
+            threading.Thread(target=self._server.serve_forever, name="grid-control", daemon=True).start()
+
+    def _on_keyframe_request(self, address, *args):
+        self._key_requested = True
+
+    def publish(self, grid):
+        flat = np.ascontiguousarray(grid, dtype=bool).ravel()
+        now = time.monotonic()
+        key_due = (self._last is None or self._key_requested
+                   or now - self._last_key >= self.keyframe_interval
+                   or self._last.shape != flat.shape)
+        if key_due:
+            self._send_key(grid, flat, now)
+            return
+
+        changed = np.flatnonzero(flat != self._last)
+        if not len(changed):
+            return
+        blob = changed.astype("<u2").tobytes()
+        if len(blob) >= (flat.size + 7) // 8:
+            # As large as the whole grid: a keyframe also resyncs
+            self._send_key(grid, flat, now)
+            return
+        self._send("/grid/delta", [self.seq, self._density(flat), blob])
+        self.deltas += 1
+        self._last = flat.copy()
+
+    def _send_key(self, grid, flat, now):
+        cols, rows = grid.shape
+        self._send("/grid/key", [self.seq, cols, rows, self._density(flat), np.packbits(flat).tobytes()])
+        self.keyframes += 1
+        self._key_requested = False
+        self._last_key = now
+        self._last = flat.copy()
+
+    @staticmethod
+    def _density(flat):
+        return float(np.count_nonzero(flat)) / max(1, flat.size)
+
+    def _send(self, address, args):
+        try:
+            self.client.send_message(address, args)
+            self.bytes += len(args[-1])
+        except Exception:
+            # Keep tolerant to network errors
+            pass
+        # Count the sequence number even when the send failed, so the
+        # receiver sees the gap
+        self.seq += 1
+
+    def stats(self):
+        return {"keyframes": self.keyframes, "deltas": self.deltas, "blob_bytes": self.bytes}
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
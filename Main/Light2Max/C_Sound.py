@@ -5,6 +5,10 @@ Usage:
 
 Controls:
     q - quit
+    s - save thresholds
+
+With --headless no window is opened; thresholds are then adjusted over
+OSC on --control_port (see control.py).
 
 """
 import argparse
@@ -16,17 +20,30 @@ import cv2
 import numpy as np
 
 import zmq
-import pickle
 
+from transport import LATEST, POLICIES, FrameRing, PubLink
+
+from .capture import FrameGrabber, RateMeter
+from .control import THRESHOLD_NAMES, ThresholdControl, clamp_thresholds
 from .detector import LightDetector
+from .motion_gate import MotionGate
 from .osc_sender import OSCClient
+from .tracker import SpotTracker
 
 
 THRESH_FILE = os.path.join(os.path.dirname(__file__), "thresholds.json")
 
 # -------- Frame publish (C -> A) --------
-FRAME_SEND_EVERY_N_FRAMES = 60
+# Frames are forwarded on motion, and at least every FRAME_KEEPALIVE seconds
+FRAME_KEEPALIVE = 1.0
+# ... and for FRAME_SETTLE seconds after motion stops, so A's pose filter
+# (One-Euro, 1 Hz minimum cutoff) settles on the resting pose
+FRAME_SETTLE = 0.5
+MOTION_MIN_CHANGED = 0.002   # fraction of changed pixels (downsampled) that counts as motion
 ZMQ_FRAME_PORT = 5555
+CONTROL_PORT = 9001          # local OSC port for threshold control
+OSC_RATE = 50.0              # Hz of the OSC sender thread
+FRAME_LINK_POLICY = LATEST   # see transport.py; A must use the same policy
 
 
 def load_thresholds():
@@ -77,10 +94,40 @@ def parse_args():
     p.add_argument("--h_high", type=int, default=180)
     p.add_argument("--l_high", type=int, default=255)
     p.add_argument("--s_high", type=int, default=255)
+    p.add_argument("--blobs", type=int, default=0,
+                   help="Track up to this many light spots and send them as one OSC bundle (0 = largest only)")
+    p.add_argument("--track", action="store_true",
+                   help="Track spots across frames and send velocity and hue (/spot messages)")
+    p.add_argument("--predict", action="store_true",
+                   help="With --track, extrapolate positions by the capture-to-send latency")
+    p.add_argument("--pyramid", type=int, default=4,
+                   help="Search the light spot on a frame downscaled by this factor first (1 = off); "
+                        "brightness then averages only the spots near the largest one")
+    p.add_argument("--frame_policy", choices=POLICIES, default=FRAME_LINK_POLICY,
+                   help="Delivery policy of the frame link to A")
+    p.add_argument("--keepalive", type=float, default=FRAME_KEEPALIVE,
+                   help="Seconds between frames forwarded to A while the scene is static")
+    p.add_argument("--settle", type=float, default=FRAME_SETTLE,
+                   help="Seconds frames keep going to A after motion stops")
+    p.add_argument("--motion_threshold", type=float, default=MOTION_MIN_CHANGED,
+                   help="Fraction of changed pixels that forwards a frame to A")
+    p.add_argument("--osc_rate", type=float, default=OSC_RATE,
+                   help="Send OSC from a separate thread at this rate in Hz (0 = inline, up to 50 Hz)")
+    p.add_argument("--osc_interpolate", action="store_true",
+                   help="Interpolate /light between detections on the OSC sender thread")
+    p.add_argument("--osc_deadband", type=float, default=0.0,
+                   help="Skip OSC sends when no normalized value changed by more than this")
+    p.add_argument("--trace_alloc", action="store_true",
+                   help="Debug: measure the detector's per-frame allocations with tracemalloc (slow)")
+    p.add_argument("--headless", action="store_true",
+                   help="No window, no trackbars; adjust thresholds over the control port")
+    p.add_argument("--control_port", type=int, default=CONTROL_PORT,
+                   help="Local OSC port for threshold control (0 = off)")
     return p.parse_args()
 
 
-def run():
+def run(frame_ring=None):
+    """frame_ring: name of the FrameRing C creates for A (set by Main.py)."""
     args = parse_args()
 
     # Open video source: file if provided, otherwise camera index
@@ -99,92 +146,117 @@ def run():
     h_low, l_low, s_low, h_high, l_high, s_high = load_thresholds()
     # Allow CLI to override loaded values if provided explicitly
     detector = LightDetector(args.h_low or h_low, args.l_low or l_low, args.s_low or s_low,
-                             args.h_high or h_high, args.l_high or l_high, args.s_high or s_high)
+                             args.h_high or h_high, args.l_high or l_high, args.s_high or s_high,
+                             pyramid_scale=args.pyramid, trace_allocations=args.trace_alloc)
     osc = OSCClient(args.host, args.port)
+    if args.osc_rate > 0:
+        osc.start(args.osc_rate, interpolate=args.osc_interpolate, deadband=args.osc_deadband)
+    tracker = SpotTracker(max_spots=max(1, args.blobs)) if args.track else None
 
     # ZeroMQ publisher: send raw frames to file A
     zmq_ctx = zmq.Context()
-    frame_pub = zmq_ctx.socket(zmq.PUB)
-    frame_pub.bind(f"tcp://*:{ZMQ_FRAME_PORT}")
-    frame_index = 0
+    frame_link = PubLink(zmq_ctx, f"tcp://*:{ZMQ_FRAME_PORT}",
+                         policy=args.frame_policy, name="C->A frames", multipart=True)
+    # Same-host A reads from shared memory; ZMQ still serves remote subscribers.
+    # The ring is created on the first frame, with slots of that size
+    ring = None
+    motion_gate = MotionGate(keepalive=args.keepalive, min_changed=args.motion_threshold,
+                             settle=args.settle)
+
+    init_vals = (detector.low[0], detector.low[1], detector.low[2], detector.high[0], detector.high[1], detector.high[2])
+    th = clamp_thresholds(init_vals)
+    control = ThresholdControl(th, port=args.control_port).start() if args.control_port else None
+    if args.headless and control is None:
+        print("Headless without a control port: thresholds are fixed")
 
     win = "Light2Max"
-    cv2.namedWindow(win, cv2.WINDOW_NORMAL)
+    if not args.headless:
+        cv2.namedWindow(win, cv2.WINDOW_NORMAL)
 
-    # Create trackbars for H, L, S (OpenCV H:0-180, L,S:0-255)
-    init_vals = (detector.low[0], detector.low[1], detector.low[2], detector.high[0], detector.high[1], detector.high[2])
-    cv2.createTrackbar("h_low", win, int(init_vals[0]), 180, lambda v: None)
-    cv2.createTrackbar("l_low", win, int(init_vals[1]), 255, lambda v: None)
-    cv2.createTrackbar("s_low", win, int(init_vals[2]), 255, lambda v: None)
-    cv2.createTrackbar("h_high", win, int(init_vals[3]), 180, lambda v: None)
-    cv2.createTrackbar("l_high", win, int(init_vals[4]), 255, lambda v: None)
-    cv2.createTrackbar("s_high", win, int(init_vals[5]), 255, lambda v: None)
+        # Create trackbars for H, L, S (OpenCV H:0-180, L,S:0-255)
+        cv2.createTrackbar("h_low", win, int(init_vals[0]), 180, lambda v: None)
+        cv2.createTrackbar("l_low", win, int(init_vals[1]), 255, lambda v: None)
+        cv2.createTrackbar("s_low", win, int(init_vals[2]), 255, lambda v: None)
+        cv2.createTrackbar("h_high", win, int(init_vals[3]), 180, lambda v: None)
+        cv2.createTrackbar("l_high", win, int(init_vals[4]), 255, lambda v: None)
+        cv2.createTrackbar("s_high", win, int(init_vals[5]), 255, lambda v: None)
 
     prev_send = 0
-    send_interval = 0.02  # send at up to 50 Hz
+    # The sender thread sets its own cadence; it takes every detection
+    send_interval = 0.0 if args.osc_rate > 0 else 0.02  # inline: send at up to 50 Hz
+
+    # Camera I/O runs on its own thread; the loop below always takes the
+    # newest frame, timestamped when it was grabbed
+    grabber = FrameGrabber(cap, is_file=bool(args.video)).start()
+    process_rate = RateMeter()
 
     while True:
-        ret, frame = cap.read()
-        if not ret:
-            # if using a video file, loop: reset to start; if camera, continue trying
-            if args.video:
-                try:
-                    cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
-                    # small pause to avoid busy-looping
-                    time.sleep(0.02)
-                    continue
-                except Exception:
-                    print("End of video file")
-                    break
-            else:
-                continue
-
-        frame_index += 1
-
-        # Read trackbar values each loop and update detector thresholds
-        th = (
-            cv2.getTrackbarPos("h_low", win),
-            cv2.getTrackbarPos("l_low", win),
-            cv2.getTrackbarPos("s_low", win),
-            cv2.getTrackbarPos("h_high", win),
-            cv2.getTrackbarPos("l_high", win),
-            cv2.getTrackbarPos("s_high", win),
-        )
-        # enforce min/max
-        h_low_v = max(0, min(180, th[0]))
-        l_low_v = max(0, min(255, th[1]))
-        s_low_v = max(0, min(255, th[2]))
-        h_high_v = max(0, min(180, th[3]))
-        l_high_v = max(0, min(255, th[4]))
-        s_high_v = max(0, min(255, th[5]))
-        detector.low = np.array([h_low_v, l_low_v, s_low_v], dtype=np.uint8)
-        detector.high = np.array([h_high_v, l_high_v, s_high_v], dtype=np.uint8)
-
-        mask, centroid, area, brightness = detector.detect(frame)
-
-        # ---- Send raw frame to file A every N frames ----
-        if frame_index % FRAME_SEND_EVERY_N_FRAMES == 0:
-            try:
-                frame_pub.send(pickle.dumps(frame), zmq.NOBLOCK)
-            except zmq.Again:
-                # No subscriber yet; safe to ignore
-                pass
+        item = grabber.read(timeout=1.0)
+        if item is None:
+            if not grabber.alive:
+                break
+            continue
+        frame, capture_ts = item
+        process_rate.tick()
+
+        # Thresholds from the control port, then (with a window) the trackbars
+        save_requested = False
+        if control is not None:
+            if control.quit:
+                break
+            update, save_requested = control.poll()
+            if update is not None:
+                th = update
+                if not args.headless:
+                    for name, v in zip(THRESHOLD_NAMES, th):
+                        cv2.setTrackbarPos(name, win, v)
+        if not args.headless:
+            # Read trackbar values each loop (enforcing min/max)
+            bars = clamp_thresholds(cv2.getTrackbarPos(name, win) for name in THRESHOLD_NAMES)
+            if bars != th:
+                # Moved by hand; report only then, so a remote update that
+                # came in meanwhile is not overwritten with stale values
+                th = bars
+                if control is not None:
+                    control.sync(th)
+        h_low_v, l_low_v, s_low_v, h_high_v, l_high_v, s_high_v = th
+        detector.set_thresholds(h_low_v, l_low_v, s_low_v, h_high_v, l_high_v, s_high_v)
+        if save_requested:
+            save_thresholds(th)
+
+        blobs = None
+        spots = None
+        if args.blobs or args.track:
+            mask, blobs = detector.detect_blobs(frame)
+            blobs = blobs[:max(1, args.blobs)]
+            if tracker is not None:
+                spots = tracker.update(blobs, capture_ts)
+            centroid, area, brightness = None, 0, 0
+            if blobs:
+                # The largest spot drives the display as in single-spot mode
+                bx, by = blobs[0]["centroid"]
+                centroid = (int(bx), int(by))
+                area = blobs[0]["area"]
+                brightness = blobs[0]["light"]
+        else:
+            mask, centroid, area, brightness = detector.detect(frame)
+
+        # ---- Send raw frame to file A on motion (or keep-alive) ----
+        if motion_gate.should_forward(frame, capture_ts):
+            # Never blocks; without a subscriber the frame is simply dropped.
+            # Sent without copying, so `frame` must not be drawn on below
+            frame_link.send_frame(frame, capture_ts)
+            if frame_ring and ring is None:
+                ring = FrameRing(frame_ring, create=True, writer=True, slot_bytes=frame.nbytes,
+                                 link_name="C->A ring")
+            if ring is not None and not ring.send_frame(frame, capture_ts) and ring.stats.dropped == 1:
+                print(f"Frame of {frame.nbytes} bytes does not fit the {ring.slot_bytes} byte ring "
+                      "slots; only ZMQ subscribers get frames of this size")
 
         h, w = frame.shape[:2]
 
-        # Create a stylized, slightly pixellated color frame for a retro look
-        # This restores the previous color + mask side-by-side layout but with pixelation
-        pixel_size = 12
-        small_w = max(1, w // pixel_size)
-        small_h = max(1, h // pixel_size)
-        small = cv2.resize(frame, (small_w, small_h), interpolation=cv2.INTER_LINEAR)
-        stylized = cv2.resize(small, (w, h), interpolation=cv2.INTER_NEAREST)
-        display = stylized.copy()
-
         if centroid is not None:
             cx, cy = centroid
-            # Draw centroid and bounding on the stylized color display
-            cv2.circle(display, (cx, cy), 8, (0, 255, 0), 2)
             # normalized values
             x_norm = cx / float(w)
             y_norm = cy / float(h)
@@ -194,8 +266,46 @@ def run():
 
             now = time.time()
             if now - prev_send >= send_interval:
-                osc.send_light(x_norm, y_norm, area_norm, brightness_norm)
+                # Bundles are timetagged with the capture time, so Max can
+                # schedule against it rather than arrival time
+                if spots is not None:
+                    # Where the spots are now rather than at capture
+                    latency = time.time() - capture_ts if args.predict else 0.0
+                    rows = []
+                    for sp in spots:
+                        px, py = sp.predict(latency)
+                        rows.append((sp.id, px / w, py / h, min(1.0, sp.area / float(w * h)),
+                                     sp.light / 255.0, sp.hue / 180.0, sp.vx / w, sp.vy / h))
+                    osc.send_spots(rows, timestamp=capture_ts + latency)
+                elif blobs is not None:
+                    osc.send_blobs([(b["centroid"][0] / w, b["centroid"][1] / h,
+                                     min(1.0, b["area"] / float(w * h)),
+                                     b["light"] / 255.0, b["hue"] / 180.0) for b in blobs],
+                                   timestamp=capture_ts)
+                else:
+                    osc.send_light(x_norm, y_norm, area_norm, brightness_norm, timestamp=capture_ts)
                 prev_send = now
+        else:
+            # Nothing detected: the sender thread must not keep repeating the last spot
+            osc.clear()
+
+        if args.headless:
+            continue
+
+        # Create a stylized, slightly pixellated color frame for a retro look
+        # This restores the previous color + mask side-by-side layout but with pixelation
+        pixel_size = 12
+        small_w = max(1, w // pixel_size)
+        small_h = max(1, h // pixel_size)
+        small = cv2.resize(frame, (small_w, small_h), interpolation=cv2.INTER_LINEAR)
+        stylized = cv2.resize(small, (w, h), interpolation=cv2.INTER_NEAREST)
+        display = stylized.copy()
+
+        if centroid is not None:
+            # Draw centroid and bounding on the stylized color display
+            cv2.circle(display, (cx, cy), 8, (0, 255, 0), 2)
+            for b in (blobs or [])[1:]:
+                cv2.circle(display, (int(b["centroid"][0]), int(b["centroid"][1])), 6, (0, 200, 255), 2)
 
             # Overlay text
             cv2.putText(display, f"x={x_norm:.2f} y={y_norm:.2f} a={area_norm:.4f} b={brightness_norm:.2f}",
@@ -204,6 +314,8 @@ def run():
         # Show current thresholds on the stylized display
         thresh_text = f"H[{h_low_v}-{h_high_v}] L[{l_low_v}-{l_high_v}] S[{s_low_v}-{s_high_v}]"
         cv2.putText(display, thresh_text, (10, display.shape[0] - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (220, 220, 0), 2)
+        fps_text = f"capture {grabber.capture_rate.rate:.1f} fps  process {process_rate.rate:.1f} fps"
+        cv2.putText(display, fps_text, (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (220, 220, 0), 2)
 
         # Show mask in small viewport — resize so heights match for hstack (restored layout)
         if mask is not None:
@@ -229,11 +341,27 @@ def run():
             # save current trackbar thresholds
             save_thresholds((h_low_v, l_low_v, s_low_v, h_high_v, l_high_v, s_high_v))
 
-    frame_pub.close()
+    grabber.stop()
+    osc.stop()
+    if osc.stats is not None:
+        print(osc.stats)
+    print(f"capture: {grabber.capture_rate.average():.1f} fps, processing: {process_rate.average():.1f} fps")
+    print("frames to A:", motion_gate.stats())
+    if detector.trace_allocations:
+        print("detector allocations per frame:", detector.alloc_stats())
+    print(frame_link.stats)
+    frame_link.close()
+    if ring is not None:
+        print(ring.stats)
+        ring.close()
     zmq_ctx.term()
 
+    if control is not None:
+        control.stop()
+
     cap.release()
-    cv2.destroyAllWindows()
+    if not args.headless:
+        cv2.destroyAllWindows()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,107 @@
+import threading
+import time
+
+import cv2
+
+
+class RateMeter:
+    """Events per second, averaged over windows of `window` seconds."""
+
+    def __init__(self, window=1.0):
+        self.window = window
+        self.count = 0
+        self.rate = 0.0
+        self.total = 0
+        self._start = time.monotonic()
+        self._first = self._start
+
+    def tick(self):
+        self.count += 1
+        self.total += 1
+        now = time.monotonic()
+        if now - self._start >= self.window:
+            self.rate = self.count / (now - self._start)
+            self.count = 0
+            self._start = now
+
+    def average(self):
+        elapsed = time.monotonic() - self._first
+        return self.total / elapsed if elapsed > 0 else 0.0
+
+
+class FrameGrabber:
+    """Drain a cv2.VideoCapture on a background thread.
+
+    Every frame is timestamped right after grab() and replaces the
+    previous one; read() hands out the newest frame, so processing never
+    waits on camera I/O and never works on a frame that sat in the
+    driver's buffer. Video files are looped and paced at their own fps.
+
+    Methods
+    - start(), stop()
+    - read(timeout) -> (frame, grab timestamp) or None
+    """
+
+    def __init__(self, cap, is_file=False):
+        self.cap = cap
+        self.is_file = is_file
+        fps = cap.get(cv2.CAP_PROP_FPS) if is_file else 0
+        self.frame_interval = 1.0 / fps if fps and fps > 0 else 0.0
+        self.capture_rate = RateMeter()
+        self.alive = False
+        self._cond = threading.Condition()
+        self._latest = None
+        self._seq = 0
+        self._read_seq = 0
+        self._thread = None
+
+    def start(self):
+        self.alive = True
+        self._thread = threading.Thread(target=self._run, name="camera-capture", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.alive = False
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+
+    def _run(self):
+        next_due = time.monotonic()
+        while self.alive:
+            if not self.cap.grab():
+                if self.is_file:
+                    # Loop the video; stop if the file cannot rewind
+                    if not self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0):
+                        print("End of video file")
+                        break
+                # small pause to avoid busy-looping
+                time.sleep(0.02)
+                continue
+            grab_ts = time.time()
+            ok, frame = self.cap.retrieve()
+            if not ok:
+                continue
+            self.capture_rate.tick()
+            with self._cond:
+                self._latest = (frame, grab_ts)
+                self._seq += 1
+                self._cond.notify()
+            if self.frame_interval:
+                next_due = max(next_due + self.frame_interval, time.monotonic() - self.frame_interval)
+                delay = next_due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+        with self._cond:
+            self.alive = False
+            self._cond.notify()
+
+    def read(self, timeout=1.0):
+        """Newest frame not handed out yet, waiting up to timeout seconds."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._seq != self._read_seq or not self.alive, timeout):
+                return None
+            if self._seq == self._read_seq:
+                return None
+            self._read_seq = self._seq
+            return self._latest
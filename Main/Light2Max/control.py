@@ -0,0 +1,103 @@
+import threading
+
+from pythonosc.dispatcher import Dispatcher
+from pythonosc.osc_server import BlockingOSCUDPServer
+
+
+THRESHOLD_NAMES = ("h_low", "l_low", "s_low", "h_high", "l_high", "s_high")
+THRESHOLD_MAX = (180, 255, 255, 180, 255, 255)   # OpenCV H:0-180, L,S:0-255
+
+
+def clamp_thresholds(values):
+    return tuple(max(0, min(hi, int(v))) for v, hi in zip(values, THRESHOLD_MAX))
+
+
+class ThresholdControl:
+    """Adjust the HLS thresholds of C over OSC while it runs.
+
+    Listens on a local UDP port for
+    - /thresholds h_low l_low s_low h_high l_high s_high
+    - /threshold/<name> value      (e.g. /threshold/l_low 210)
+    - /thresholds/save             persist the current values
+    - /quit                        stop C
+
+    The OSC server runs on its own thread and only records requests; the
+    processing loop picks them up with poll().
+
+    Methods
+    - start(), stop()
+    - poll() -> (new thresholds or None, save requested)
+    - sync(values): report thresholds changed elsewhere (trackbars); a
+      remote update not yet polled takes precedence
+    """
+
+    def __init__(self, values, host="127.0.0.1", port=9001):
+        self.host = host
+        self.port = port
+        self.quit = False
+        self._values = clamp_thresholds(values)
+        self._changed = False
+        self._save = False
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        dispatcher = Dispatcher()
+        dispatcher.map("/thresholds", self._on_all)
+        dispatcher.map("/threshold/*", self._on_one)
+        dispatcher.map("/thresholds/save", self._on_save)
+        dispatcher.map("/quit", self._on_quit)
+        self._server = BlockingOSCUDPServer((self.host, self.port), dispatcher)
+        self._thread = threading.Thread(target=self._server.serve_forever, name="threshold-control",
+                                        daemon=True)
+        self._thread.start()
+        print(f"Threshold control on osc://{self.host}:{self.port}")
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def _set(self, values):
+        with self._lock:
+            values = clamp_thresholds(values)
+            if values != self._values:
+                self._values = values
+                self._changed = True
+
+    def _on_all(self, address, *args):
+        if len(args) != len(THRESHOLD_NAMES):
+            print(f"{address} expects {len(THRESHOLD_NAMES)} values, got {len(args)}")
+            return
+        self._set(args)
+
+    def _on_one(self, address, *args):
+        name = address.rsplit("/", 1)[-1]
+        if name not in THRESHOLD_NAMES or len(args) != 1:
+            print("Unknown threshold message:", address, args)
+            return
+        with self._lock:
+            values = list(self._values)
+        values[THRESHOLD_NAMES.index(name)] = args[0]
+        self._set(values)
+
+    def _on_save(self, address, *args):
+        with self._lock:
+            self._save = True
+
+    def _on_quit(self, address, *args):
+        self.quit = True
+
+    def poll(self):
+        with self._lock:
+            values = self._values if self._changed else None
+            save = self._save
+            self._changed = self._save = False
+        return values, save
+
+    def sync(self, values):
+        with self._lock:
+            if not self._changed:
+                self._values = clamp_thresholds(values)
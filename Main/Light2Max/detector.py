@@ -1,39 +1,160 @@
+import math
+import tracemalloc
+
 import cv2
 import numpy as np
 
 
+# Per-level tables for blob statistics from histograms. 8-bit H is 0-180,
+# 180 being the rounded top of the hue circle
+_HUE_ANGLES = np.arange(181) * (np.pi / 90.0)   # hue is an angle: 0 and 180 are both red
+_HUE_SIN = np.sin(_HUE_ANGLES)
+_HUE_COS = np.cos(_HUE_ANGLES)
+_SAT_LEVELS = np.arange(256, dtype=np.float32)
+
+
 class LightDetector:
     """Detect bright colored light spots using HLS thresholding.
 
     Methods
     - detect(frame) -> mask, (cx, cy), area, mean_light
+    - detect_blobs(frame) -> mask, blobs (all spots, largest first)
+    - set_thresholds(h_low, l_low, s_low, h_high, l_high, s_high)
+
+    With pyramid_scale > 1 the spot is first searched on a frame downscaled
+    by that factor; centroid, area and mean lightness are then refined at
+    full resolution inside an ROI around the candidate. When the coarse
+    search or the refinement finds nothing, the full frame is searched, and
+    the following frames go straight to the full-frame search until it
+    finds a spot again, so an empty scene costs no more than without the
+    pyramid. In pyramid mode mean_light covers only the spots inside the
+    ROI (the largest one and its close neighbours), not every spot in the
+    frame; with a single spot it is the same.
+
+    All intermediate images live in buffers owned by the detector and are
+    written through the OpenCV dst= parameters; they are only reallocated
+    when the frame size changes. The returned mask is one of those buffers
+    and is valid until the next detect().
+
+    trace_allocations=True (debug, slow) measures with tracemalloc how much
+    memory each detect()/detect_blobs() call allocates at its peak; see
+    alloc_stats().
     """
 
-    def __init__(self, h_low=0, l_low=200, s_low=100, h_high=180, l_high=255, s_high=255):
+    def __init__(self, h_low=0, l_low=200, s_low=100, h_high=180, l_high=255, s_high=255,
+                 pyramid_scale=1, roi_pad=16, min_blob_area=20, trace_allocations=False):
         # H, L, S thresholds in HLS space (OpenCV uses H:0-180, L,S:0-255)
         self.low = np.array([h_low, l_low, s_low], dtype=np.uint8)
         self.high = np.array([h_high, l_high, s_high], dtype=np.uint8)
+        self.pyramid_scale = max(1, int(pyramid_scale))
+        self.roi_pad = roi_pad   # full-resolution pixels added around a coarse candidate
+        self.min_blob_area = min_blob_area   # smaller components are ignored by detect_blobs
+        self.kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+        self._shape = None
+        self._spot_seen = True   # pyramid mode: the last detect() found a spot
+        # Per-blob histograms of detect_blobs
+        self._hue_hist = np.empty((181, 1), np.float32)
+        self._hue_sat_hist = np.empty((181, 256), np.float32)
+        self._hue_weights = np.empty(181, np.float32)
+        self.trace_allocations = trace_allocations
+        self.traced_calls = 0
+        self.alloc_peak_total = 0   # bytes, summed over traced calls
+        self.alloc_peak_max = 0
+        self.buffer_bytes = 0       # peak of the last call that (re)allocated the buffers
+        if trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
 
-    def detect(self, frame):
-        """Return mask, centroid (x,y), area, mean_light
+    def set_thresholds(self, h_low, l_low, s_low, h_high, l_high, s_high):
+        """Update the thresholds in place."""
+        self.low[0], self.low[1], self.low[2] = h_low, l_low, s_low
+        self.high[0], self.high[1], self.high[2] = h_high, l_high, s_high
 
-        centroid is None if nothing found.
-        area is the pixel area of the detected mask.
-        mean_light is mean of the L channel inside the mask (0-255).
+    def _ensure_buffers(self, frame):
+        h, w = frame.shape[:2]
+        if self._shape == (h, w):
+            return
+        self._shape = (h, w)
+        s = self.pyramid_scale
+        sw, sh = max(1, w // s), max(1, h // s)
+        self._hls = np.empty((h, w, 3), np.uint8)
+        self._mask = np.empty((h, w), np.uint8)
+        self._tmp = np.empty((h, w), np.uint8)
+        self._roi_mask = np.empty((h, w), np.uint8)
+        self._labels = np.empty((h, w), np.int32)
+        self._blob_mask = np.empty((h, w), np.uint8)
+        self._small = np.empty((sh, sw, 3), np.uint8)
+        self._small_hls = np.empty((sh, sw, 3), np.uint8)
+        self._small_mask = np.empty((sh, sw), np.uint8)
+
+    def _traced(self, fn, frame):
+        """fn(frame), recording the peak memory it allocated beyond what was in use."""
+        before = tracemalloc.get_traced_memory()[0]
+        shape = self._shape
+        tracemalloc.reset_peak()
+        result = fn(frame)
+        peak = tracemalloc.get_traced_memory()[1] - before
+        if self._shape != shape:
+            # New buffers, not a per-frame cost
+            self.buffer_bytes = peak
+            return result
+        self.traced_calls += 1
+        self.alloc_peak_total += peak
+        self.alloc_peak_max = max(self.alloc_peak_max, peak)
+        return result
+
+    def alloc_stats(self):
+        """Per-call peak allocation (bytes) with trace_allocations, else None.
+
+        Calls that (re)allocated the buffers are left out; buffer_bytes is
+        the last of them.
         """
-        if frame is None:
-            return None, None, 0, 0
+        if not self.trace_allocations:
+            return None
+        return {"calls": self.traced_calls,
+                "mean_peak_bytes": self.alloc_peak_total // max(1, self.traced_calls),
+                "max_peak_bytes": self.alloc_peak_max,
+                "buffer_bytes": self.buffer_bytes}
+
+    def _coarse_roi(self, frame):
+        """(x0, y0, x1, y1) around the largest candidate on the small frame, or None."""
+        h, w = frame.shape[:2]
+        s = self.pyramid_scale
+        sh, sw = self._small.shape[:2]
+        # Nearest-neighbour keeps the pixel colours, so the same thresholds
+        # apply; averaging would wash out a small spot
+        cv2.resize(frame, (sw, sh), dst=self._small, interpolation=cv2.INTER_NEAREST)
+        cv2.cvtColor(self._small, cv2.COLOR_BGR2HLS, dst=self._small_hls)
+        cv2.inRange(self._small_hls, self.low, self.high, dst=self._small_mask)
+        contours, _ = cv2.findContours(self._small_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        if not contours:
+            return None
+        x, y, bw, bh = cv2.boundingRect(max(contours, key=cv2.contourArea))
+        pad = self.roi_pad + s
+        return (max(0, x * s - pad), max(0, y * s - pad),
+                min(w, (x + bw) * s + pad), min(h, (y + bh) * s + pad))
+
+    def _threshold(self, frame):
+        """HLS image and cleaned-up mask of frame (or a view of it)."""
+        h, w = frame.shape[:2]
+        # Views of the top-left corner of the buffers when frame is an ROI
+        hls = self._hls[:h, :w]
+        mask = self._mask[:h, :w]
+        tmp = self._tmp[:h, :w]
 
         # Convert to HLS (OpenCV uses HLS naming; H,L,S)
-        hls = cv2.cvtColor(frame, cv2.COLOR_BGR2HLS)
+        cv2.cvtColor(frame, cv2.COLOR_BGR2HLS, dst=hls)
 
         # Threshold
-        mask = cv2.inRange(hls, self.low, self.high)
+        cv2.inRange(hls, self.low, self.high, dst=mask)
 
         # Optional: morphological clean-up
-        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
-        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel, iterations=1)
-        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel, iterations=1)
+        cv2.morphologyEx(mask, cv2.MORPH_OPEN, self.kernel, dst=tmp, iterations=1)
+        cv2.morphologyEx(tmp, cv2.MORPH_CLOSE, self.kernel, dst=mask, iterations=1)
+        return hls, mask
+
+    def _detect_region(self, frame):
+        """Full detection pipeline on frame (or a view of it)."""
+        hls, mask = self._threshold(frame)
 
         # Find contours to compute area and centroid
         contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
@@ -52,11 +173,103 @@ class LightDetector:
         cx = int(M["m10"] / M["m00"])
         cy = int(M["m01"] / M["m00"])
 
-        # Mean lightness inside mask (L channel)
-        l_channel = hls[:, :, 1]
+        # Mean lightness inside mask (L channel), over the box that holds all
+        # mask pixels. cv2.mean scales by 1/n, so go back to the exact
+        # integer sum before truncating
+        bx, by, bw, bh = cv2.boundingRect(mask)
+        box_mask = mask[by:by + bh, bx:bx + bw]
+        count = cv2.countNonZero(box_mask)
         mean_light = 0
-        mask_bool = mask.astype(bool)
-        if mask_bool.any():
-            mean_light = int(l_channel[mask_bool].mean())
+        if count:
+            mean = cv2.mean(hls[by:by + bh, bx:bx + bw], mask=box_mask)[1]
+            mean_light = int(round(mean * count)) // count
 
         return mask, (cx, cy), area, mean_light
+
+    def detect(self, frame):
+        """Return mask, centroid (x,y), area, mean_light
+
+        centroid is None if nothing found.
+        area is the pixel area of the detected mask.
+        mean_light is mean of the L channel inside the mask (0-255).
+        """
+        if frame is None:
+            return None, None, 0, 0
+        if self.trace_allocations:
+            return self._traced(self._detect, frame)
+        return self._detect(frame)
+
+    def _detect(self, frame):
+        self._ensure_buffers(frame)
+
+        if self.pyramid_scale > 1 and self._spot_seen:
+            roi = self._coarse_roi(frame)
+            if roi is not None:
+                x0, y0, x1, y1 = roi
+                roi_mask, centroid, area, mean_light = self._detect_region(frame[y0:y1, x0:x1])
+                if centroid is not None:
+                    mask = self._roi_mask
+                    mask.fill(0)
+                    mask[y0:y1, x0:x1] = roi_mask
+                    return mask, (centroid[0] + x0, centroid[1] + y0), area, mean_light
+            # Lost at the coarse level or in the ROI: search the whole frame
+
+        mask, centroid, area, mean_light = self._detect_region(frame)
+        self._spot_seen = centroid is not None
+        return mask, centroid, area, mean_light
+
+    def detect_blobs(self, frame):
+        """Return mask, blobs
+
+        blobs holds every spot of at least min_blob_area pixels, largest
+        first, each a dict with
+        - centroid (x, y) floats, area (pixels), bbox (x, y, w, h)
+        - light: mean L (0-255), hue: circular mean H (0-180)
+        - dominant_hue: saturation-weighted most common H (0-180)
+        Area, bbox and centroid come from a single
+        connectedComponentsWithStats pass. The other values come from a
+        mask of the blob and histograms over its bounding box, all written
+        into detector buffers.
+        """
+        if frame is None:
+            return None, []
+        if self.trace_allocations:
+            return self._traced(self._detect_blobs, frame)
+        return self._detect_blobs(frame)
+
+    def _detect_blobs(self, frame):
+        self._ensure_buffers(frame)
+        hls, mask = self._threshold(frame)
+        # Block-based labelling (Grana) is about 3x faster than the default
+        # on our mostly empty masks
+        n, labels, stats, centroids = cv2.connectedComponentsWithStatsWithAlgorithm(
+            mask, 8, cv2.CV_32S, cv2.CCL_GRANA, labels=self._labels)
+
+        blobs = []
+        # Label 0 is the background
+        for i in range(1, n):
+            x, y, w, h, area = (int(v) for v in stats[i])
+            if area < self.min_blob_area:
+                continue
+            box = hls[y:y + h, x:x + w]
+            sel = cv2.compare(labels[y:y + h, x:x + w], i, cv2.CMP_EQ, dst=self._blob_mask[y:y + h, x:x + w])
+            light = cv2.mean(box, mask=sel)[1]
+            # Circular mean of the hue angle, from the pixel count per hue
+            counts = cv2.calcHist([box], [0], sel, [181], [0, 181], hist=self._hue_hist).ravel()
+            hue = math.degrees(math.atan2(counts.dot(_HUE_SIN), counts.dot(_HUE_COS))) / 2.0 % 180.0
+            # Most common hue, weighted by saturation: a beam's washed-out
+            # white core has no meaningful hue. The float32 sums are exact
+            # up to 2**24, i.e. for blobs of up to 65k pixels
+            hist = cv2.calcHist([box], [0, 2], sel, [181, 256], [0, 181, 0, 256], hist=self._hue_sat_hist)
+            dominant = hist.dot(_SAT_LEVELS, out=self._hue_weights).argmax()
+            blobs.append({
+                "centroid": (float(centroids[i][0]), float(centroids[i][1])),
+                "area": area,
+                "bbox": (x, y, w, h),
+                "light": light,
+                "hue": float(hue),
+                "dominant_hue": int(dominant),
+            })
+
+        blobs.sort(key=lambda b: b["area"], reverse=True)
+        return mask, blobs
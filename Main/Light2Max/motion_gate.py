@@ -0,0 +1,58 @@
+import cv2
+
+
+class MotionGate:
+    """Decide which camera frames are worth forwarding to the marker detector.
+
+    A frame is forwarded as soon as its downsampled grayscale version differs
+    from the last forwarded one, for settle seconds after such motion (so
+    the detector's pose filter converges on where the markers came to rest),
+    or when keepalive seconds passed without a forward (static scene).
+    Everything else is suppressed.
+
+    Methods
+    - should_forward(frame, now) -> bool
+    - stats() -> dict with forwarded / suppressed counters
+    """
+
+    def __init__(self, keepalive=1.0, pixel_delta=12, min_changed=0.002, size=(80, 45), settle=0.5):
+        self.keepalive = keepalive        # seconds between forwards of a static scene
+        self.settle = settle              # seconds frames keep flowing after motion stops
+        self.pixel_delta = pixel_delta    # gray level change that counts a pixel as changed
+        self.min_changed = min_changed    # fraction of changed pixels that counts as motion
+        self.size = size                  # (w, h) of the comparison image
+        self.forwarded = 0
+        self.suppressed = 0
+        self._ref = None                  # downsampled last forwarded frame
+        self._last_forward = None
+        self._last_motion = None
+
+    def should_forward(self, frame, now):
+        small = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+        if self._ref is None:
+            forward = True
+            self._last_motion = now
+        else:
+            # Compare with the last forwarded frame, not the previous one,
+            # so slow drift still adds up to a forward
+            diff = cv2.absdiff(small, self._ref)
+            _, changed = cv2.threshold(diff, self.pixel_delta, 255, cv2.THRESH_BINARY)
+            moved = cv2.countNonZero(changed) >= self.min_changed * changed.size
+            if moved:
+                self._last_motion = now
+            forward = (moved or now - self._last_motion < self.settle
+                       or now - self._last_forward >= self.keepalive)
+
+        if forward:
+            self._ref = small
+            self._last_forward = now
+            self.forwarded += 1
+        else:
+            self.suppressed += 1
+        return forward
+
+    def stats(self):
+        return {"forwarded": self.forwarded, "suppressed": self.suppressed}
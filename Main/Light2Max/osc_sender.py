@@ -1,17 +1,284 @@
+import math
+import threading
+import time
+
+from pythonosc import osc_bundle_builder, osc_message_builder
 from pythonosc.udp_client import SimpleUDPClient
 
 
+LIGHT = "light"
+BLOBS = "blobs"
+SPOTS = "spots"
+
+
+def _message(address, values):
+    msg = osc_message_builder.OscMessageBuilder(address=address)
+    for v in values:
+        msg.add_arg(v)
+    return msg.build()
+
+
+def _frame_message(seq, timestamp):
+    """/frame seq capture_ms: capture time as ms of the (UTC) day, which
+    fits an OSC int32 at full precision where a float32 would not."""
+    return _message("/frame", [seq, int(timestamp % 86400.0 * 1000.0)])
+
+
+def _flatten(kind, payload):
+    if kind == LIGHT:
+        return list(payload)
+    return [v for row in payload for v in row]
+
+
+class SendStats:
+    """Cadence of the OSC sender thread.
+
+    lateness is how far each tick woke up after its scheduled time; jitter
+    is its standard deviation.
+    """
+
+    def __init__(self, period):
+        self.period = period
+        self.ticks = 0
+        self.sent = 0
+        self.skipped = 0          # ticks within the deadband or without new data
+        self.missed = 0           # ticks lost because the thread fell behind
+        self.max_lateness = 0.0
+        self._sum = 0.0
+        self._sum_sq = 0.0
+        self._start = time.monotonic()
+
+    def tick(self, lateness):
+        self.ticks += 1
+        self._sum += lateness
+        self._sum_sq += lateness * lateness
+        self.max_lateness = max(self.max_lateness, lateness)
+
+    def as_dict(self):
+        n = max(1, self.ticks)
+        mean = self._sum / n
+        elapsed = time.monotonic() - self._start
+        return {
+            "send_rate": self.sent / elapsed if elapsed > 0 else 0.0,
+            "sent": self.sent,
+            "skipped": self.skipped,
+            "missed": self.missed,
+            "mean_lateness_ms": mean * 1000.0,
+            "jitter_ms": math.sqrt(max(0.0, self._sum_sq / n - mean * mean)) * 1000.0,
+            "max_lateness_ms": self.max_lateness * 1000.0,
+        }
+
+    def __str__(self):
+        d = self.as_dict()
+        return (f"[OSC] {d['send_rate']:.1f} sends/s (target {1.0 / self.period:.0f}), "
+                f"sent={d['sent']} skipped={d['skipped']} missed={d['missed']} "
+                f"jitter={d['jitter_ms']:.2f}ms max late={d['max_lateness_ms']:.2f}ms")
+
+
 class OSCClient:
+    """Send light detections to Max/MSP.
+
+    By default every send_* call goes out immediately. After start(rate)
+    a sender thread owns the socket instead: send_* only record the latest
+    state, and the thread emits it every 1/rate seconds of the monotonic
+    clock, so the output cadence does not follow frame-time hiccups and a
+    slow send never stalls capture.
+
+    - interpolate: /light values are rendered one detection interval in
+      the past, interpolated between the two surrounding detections
+    - deadband: skip a tick when no value moved by more than this since
+      the last send (still resent every `keepalive` seconds)
+
+    clear() drops the recorded state when there is no detection, so the
+    thread goes quiet rather than repeating a light that is gone.
+
+    Given the capture timestamp, each send is a single OSC bundle (one
+    datagram) whose timetag is the capture time. It opens with
+    /frame seq capture_ms, for receivers that do not expose timetags (Max's
+    udpreceive), followed by /light and the per-spot messages.
+    """
+
     def __init__(self, host="127.0.0.1", port=8000):
         self.client = SimpleUDPClient(host, port)
+        self.stats = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._latest = None        # (kind, payload, monotonic time) of the newest state
+        self._previous = None      # the /light state before it, for interpolation
+        self._interval = 0.0       # smoothed time between /light states
+        self._frame_seq = 0        # numbers the timestamped bundles
+
+    # ---------------- Sender thread ----------------
+    def start(self, rate=50.0, interpolate=False, deadband=0.0, keepalive=1.0):
+        self.period = 1.0 / rate
+        self.interpolate = interpolate
+        self.deadband = deadband
+        self.keepalive = keepalive
+        self.stats = SendStats(self.period)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="osc-sender", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join(timeout=1.0)
+            self._thread = None
+
+    def _submit(self, kind, payload, timestamp):
+        """Send now, or hand the state to the sender thread when it runs."""
+        if self._thread is None:
+            self._emit(kind, payload, timestamp)
+            return
+        now = time.monotonic()
+        with self._lock:
+            latest = self._latest
+            if kind == LIGHT and latest is not None and latest[0] == LIGHT:
+                dt = now - latest[2]
+                self._interval = dt if not self._interval else 0.8 * self._interval + 0.2 * dt
+                self._previous = latest
+            else:
+                self._previous = None
+            self._latest = (kind, payload, now, timestamp)
 
-    def send_light(self, x_norm, y_norm, area_norm, brightness):
+    def clear(self):
+        """Forget the latest state (nothing detected); the sender thread stops sending."""
+        with self._lock:
+            self._latest = self._previous = None
+            self._interval = 0.0
+
+    def _render(self, now):
+        """State to send at time now, or None."""
+        with self._lock:
+            latest, previous, interval = self._latest, self._previous, self._interval
+        if latest is None:
+            return None
+        kind, payload, t1, timestamp = latest
+        if self.interpolate and kind == LIGHT and previous is not None and interval > 0:
+            # Render one detection interval behind, between the last two detections
+            _, p0, t0, ts0 = previous
+            a = min(1.0, max(0.0, (now - interval - t0) / max(1e-6, t1 - t0)))
+            payload = [v0 + a * (v1 - v0) for v0, v1 in zip(p0, payload)]
+            if timestamp is not None and ts0 is not None:
+                timestamp = ts0 + a * (timestamp - ts0)
+        return kind, payload, timestamp
+
+    def _run(self):
+        stats = self.stats
+        last_values = None
+        last_kind = None
+        last_send = 0.0
+        next_tick = time.monotonic()
+        while not self._stop.is_set():
+            next_tick += self.period
+            delay = next_tick - time.monotonic()
+            if delay > 0 and self._stop.wait(delay):
+                break
+            now = time.monotonic()
+            lateness = now - next_tick
+            if lateness > self.period:
+                # Fell behind (e.g. a slow send): drop the missed ticks
+                # rather than bursting to catch up
+                stats.missed += int(lateness / self.period)
+                next_tick = now
+                lateness = 0.0
+            stats.tick(lateness)
+
+            state = self._render(now)
+            if state is None:
+                # Cleared: whatever is detected next goes out right away
+                last_values = last_kind = None
+                stats.skipped += 1
+                continue
+            kind, payload, timestamp = state
+            values = _flatten(kind, payload)
+            if (kind == last_kind and last_values is not None and len(values) == len(last_values)
+                    and now - last_send < self.keepalive
+                    and all(abs(v - w) <= self.deadband for v, w in zip(values, last_values))):
+                stats.skipped += 1
+                continue
+            self._emit(kind, payload, timestamp)
+            stats.sent += 1
+            last_kind, last_values, last_send = kind, values, now
+
+    def _emit(self, kind, payload, timestamp):
+        if kind == LIGHT:
+            self._send_light(payload, timestamp)
+        elif kind == BLOBS:
+            self._send_blobs(payload, timestamp)
+        else:
+            self._send_spots(payload, timestamp)
+
+    # ---------------- Messages ----------------
+    def send_light(self, x_norm, y_norm, area_norm, brightness, timestamp=None):
         """Send values to address /light: x, y, area, brightness
 
-        All values should be floats (0-1 for normalized).
+        All values should be floats (0-1 for normalized). With a capture
+        timestamp (time.time()) they go out as a timetagged bundle.
         """
+        self._submit(LIGHT, [float(x_norm), float(y_norm), float(area_norm), float(brightness)], timestamp)
+
+    def _send_light(self, light, timestamp):
+        try:
+            if timestamp is None:
+                self.client.send_message("/light", light)
+            else:
+                self._send_bundle(light, None, None, [], timestamp)
+        except Exception:
+            # Keep tolerant to network errors
+            pass
+
+    def _send_bundle(self, light, count_address, address, rows, timestamp=None):
+        if timestamp is None:
+            bundle = osc_bundle_builder.OscBundleBuilder(osc_bundle_builder.IMMEDIATELY)
+        else:
+            bundle = osc_bundle_builder.OscBundleBuilder(timestamp)
+            bundle.add_content(_frame_message(self._frame_seq, timestamp))
+            self._frame_seq += 1
+        if light is not None:
+            bundle.add_content(_message("/light", [float(v) for v in light]))
+        if count_address is not None:
+            bundle.add_content(_message(count_address, [len(rows)]))
+        for row in rows:
+            bundle.add_content(_message(address, row))
+        self.client.send(bundle.build())
+
+    def send_blobs(self, blobs, timestamp=None):
+        """Send all light spots in one OSC bundle.
+
+        blobs: (x, y, area, brightness, hue) per spot, largest first, all
+        normalized to 0-1. The bundle holds /light for the largest spot (as
+        send_light does), /blobs/count and one /blob message per spot:
+        index, x, y, area, brightness, hue.
+        """
+        self._submit(BLOBS, [tuple(blob) for blob in blobs], timestamp)
+
+    def _send_blobs(self, blobs, timestamp):
+        try:
+            light = blobs[0][:4] if blobs else None
+            rows = [[i] + [float(v) for v in blob] for i, blob in enumerate(blobs)]
+            self._send_bundle(light, "/blobs/count", "/blob", rows, timestamp)
+        except Exception:
+            # Keep tolerant to network errors
+            pass
+
+    def send_spots(self, spots, timestamp=None):
+        """Send tracked light spots in one OSC bundle.
+
+        spots: (id, x, y, area, brightness, hue, vx, vy) per spot, largest
+        first; x, y, area, brightness, hue normalized to 0-1, vx, vy in
+        frame widths/heights per second. The bundle holds /light for the
+        first spot, /spots/count and one /spot message per spot.
+        """
+        self._submit(SPOTS, [tuple(spot) for spot in spots], timestamp)
+
+    def _send_spots(self, spots, timestamp):
         try:
-            self.client.send_message("/light", [float(x_norm), float(y_norm), float(area_norm), float(brightness)])
+            light = spots[0][1:5] if spots else None
+            rows = [[int(spot[0])] + [float(v) for v in spot[1:]] for spot in spots]
+            self._send_bundle(light, "/spots/count", "/spot", rows, timestamp)
         except Exception:
             # Keep tolerant to network errors
             pass
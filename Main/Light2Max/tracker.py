@@ -0,0 +1,100 @@
+import math
+
+
+class SpotTrack:
+    """State of one light spot across frames (pixels, seconds)."""
+
+    def __init__(self, track_id, blob, t):
+        self.id = track_id
+        self.x, self.y = blob["centroid"]
+        self.vx = self.vy = 0.0
+        self.ax = self.ay = 0.0
+        self.t = t
+        self.missed = 0
+        self._take(blob)
+
+    def _take(self, blob):
+        self.area = blob["area"]
+        self.light = blob["light"]
+        self.hue = blob.get("dominant_hue", blob["hue"])
+
+    def expected(self, t):
+        """Constant-velocity guess of the position at time t."""
+        dt = t - self.t
+        return self.x + self.vx * dt, self.y + self.vy * dt
+
+    def update(self, blob, t, smoothing):
+        dt = t - self.t
+        x, y = blob["centroid"]
+        if dt > 0:
+            # Finite differences, smoothed incrementally (exponential average)
+            k = 1.0 - smoothing
+            vx, vy = (x - self.x) / dt, (y - self.y) / dt
+            ax, ay = (vx - self.vx) / dt, (vy - self.vy) / dt
+            self.vx += k * (vx - self.vx)
+            self.vy += k * (vy - self.vy)
+            self.ax += k * (ax - self.ax)
+            self.ay += k * (ay - self.ay)
+            self.t = t
+        self.x, self.y = x, y
+        self.missed = 0
+        self._take(blob)
+
+    def predict(self, horizon):
+        """Position extrapolated `horizon` seconds past the last measurement."""
+        h = max(0.0, horizon)
+        return (self.x + self.vx * h + 0.5 * self.ax * h * h,
+                self.y + self.vy * h + 0.5 * self.ay * h * h)
+
+    @property
+    def speed(self):
+        return math.hypot(self.vx, self.vy)
+
+
+class SpotTracker:
+    """Per-spot state on top of LightDetector.detect_blobs.
+
+    Blobs are matched to tracks greedily (largest blob first) by distance
+    to where each track is expected at the new timestamp; a blob farther
+    than max_jump pixels from every track starts a new one. Tracks that
+    miss more than lost_after frames are dropped.
+
+    Methods
+    - update(blobs, t) -> tracks seen in this frame, largest first
+    """
+
+    def __init__(self, max_spots=1, max_jump=120.0, lost_after=5, smoothing=0.5):
+        self.max_spots = max_spots
+        self.max_jump = max_jump
+        self.lost_after = lost_after
+        self.smoothing = smoothing   # 0 = raw differences, closer to 1 = smoother
+        self.tracks = []
+        self._next_id = 0
+
+    def update(self, blobs, t):
+        free = list(self.tracks)
+        seen = []
+        for blob in blobs:
+            bx, by = blob["centroid"]
+            best, best_d = None, self.max_jump
+            for track in free:
+                ex, ey = track.expected(t)
+                d = math.hypot(bx - ex, by - ey)
+                if d < best_d:
+                    best, best_d = track, d
+            if best is not None:
+                free.remove(best)
+                best.update(blob, t, self.smoothing)
+                seen.append(best)
+            elif len(self.tracks) < self.max_spots:
+                track = SpotTrack(self._next_id, blob, t)
+                self._next_id += 1
+                self.tracks.append(track)
+                seen.append(track)
+
+        for track in free:
+            track.missed += 1
+        self.tracks = [tr for tr in self.tracks if tr.missed <= self.lost_after]
+
+        seen.sort(key=lambda tr: tr.area, reverse=True)
+        return seen
@@ -1,17 +1,23 @@
 # project/main.py
 from multiprocessing import Process
 import time
+import os
 import signal
 import sys
 
 from Light2Max.C_Sound import run as run_light2max
 from AreciboMessage.A_ArUcoDetector import run as run_aruco
 from AreciboMessage.B_AreciboMessage import run as run_render
+from transport import unlink_ring
 
 
 def main():
-    p_c = Process(target=run_light2max, name="Light2Max-C")
-    p_a = Process(target=run_aruco, name="Aruco-A")
+    # C and A share this host: frames go through shared memory, not TCP.
+    # C creates the ring once it knows the camera's frame size
+    frame_ring = f"luminous_frames_{os.getpid()}"
+
+    p_c = Process(target=run_light2max, name="Light2Max-C", kwargs={"frame_ring": frame_ring})
+    p_a = Process(target=run_aruco, name="Aruco-A", kwargs={"frame_ring": frame_ring})
     p_b = Process(target=run_render, name="Render-B")
 
     p_c.start()
@@ -33,6 +39,8 @@ def main():
             if p.is_alive():
                 p.terminate()
                 p.join()
+        # C does not get to close it when terminated
+        unlink_ring(frame_ring)
 
         sys.exit(0)
 
@@ -0,0 +1,408 @@
+"""ZMQ PUB/SUB links with a configurable delivery policy.
+
+Used by the C -> A (frames) and A -> B (ArUco markers) links. Python
+objects are pickled; camera frames use a multipart format instead, a
+small fixed header followed by the raw pixel buffer, sent and received
+without copying. When C and A run on the same host (Main.py), frames go
+through a shared-memory ring (FrameRing) instead and ZMQ only serves
+subscribers on other hosts.
+
+Policies:
+    latest    - only the newest message matters; stale ones are dropped
+                (conflated on the subscriber where the wire format allows)
+    queue     - bounded queue of `depth` messages, the oldest are dropped
+    lossless  - unbounded queues, every message is delivered in order
+
+Dropping happens on the subscriber, which sees the newest data (a full
+PUB queue would drop the newest messages instead). The exception is a
+latest-policy frame link: conflation does not work for multipart
+messages, so both ends cap their queues at FRAME_HWM frames to keep a
+stalled subscriber from piling up raw frames in memory. Every message
+carries a sequence number, so the subscriber counts messages lost anywhere
+on the way as well as the ones it discards itself.
+"""
+import pickle
+import struct
+import sys
+import time
+from collections import deque
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+import zmq
+
+
+LATEST = "latest"
+QUEUE = "queue"
+LOSSLESS = "lossless"
+POLICIES = (LATEST, QUEUE, LOSSLESS)
+
+DEFAULT_QUEUE_DEPTH = 8
+FRAME_HWM = 2   # ZMQ queue limit per end of a latest-policy multipart link
+
+
+class LinkStats:
+    """Per-link counters: sent (publisher), delivered and dropped (subscriber).
+
+    A publisher counts as dropped the frames it could not write at all
+    (FrameRing slot too small)."""
+
+    def __init__(self, name, publisher):
+        self.name = name
+        self.publisher = publisher
+        self.sent = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    def as_dict(self):
+        return {"sent": self.sent, "delivered": self.delivered, "dropped": self.dropped}
+
+    def __str__(self):
+        if self.publisher:
+            if self.dropped:
+                return f"[{self.name}] sent={self.sent} dropped={self.dropped}"
+            return f"[{self.name}] sent={self.sent}"
+        return f"[{self.name}] delivered={self.delivered} dropped={self.dropped}"
+
+
+# ---------------- Frame wire format ----------------
+# seq, capture timestamp, ndim, shape (unused dims are 0), dtype string
+FRAME_HEADER = struct.Struct("<QdB3I8s")
+
+
+def pack_frame_header(frame, seq, timestamp):
+    if frame.ndim not in (2, 3):
+        raise ValueError(f"expected a 2D or 3D frame, got shape {frame.shape}")
+    shape = tuple(frame.shape) + (0,) * (3 - frame.ndim)
+    return FRAME_HEADER.pack(seq, timestamp, frame.ndim, *shape, frame.dtype.str.encode())
+
+
+def unpack_frame_header(buf):
+    """Returns (seq, timestamp, shape, dtype)."""
+    seq, timestamp, ndim, d0, d1, d2, dtype = FRAME_HEADER.unpack(buf)
+    return seq, timestamp, (d0, d1, d2)[:ndim], np.dtype(dtype.rstrip(b"\0").decode())
+
+
+def _check_policy(policy):
+    if policy not in POLICIES:
+        raise ValueError(f"unknown link policy {policy!r}, expected one of {POLICIES}")
+
+
+class PubLink:
+    """Publishing end of a link; multipart=True for frame links (send_frame)."""
+
+    def __init__(self, ctx, endpoint, policy=LATEST, name="link", multipart=False):
+        _check_policy(policy)
+        self.policy = policy
+        self.stats = LinkStats(name, publisher=True)
+        self.seq = 0
+        self.socket = ctx.socket(zmq.PUB)
+        if policy == LOSSLESS:
+            self.socket.setsockopt(zmq.SNDHWM, 0)   # unlimited
+        elif policy == LATEST and multipart:
+            # Each queued frame also pins the caller's array (copy=False)
+            self.socket.setsockopt(zmq.SNDHWM, FRAME_HWM)
+        self.socket.bind(endpoint)
+
+    def send_obj(self, obj):
+        """Pickle and publish obj; never blocks."""
+        self.seq += 1
+        try:
+            self.socket.send(pickle.dumps((self.seq, obj)), zmq.NOBLOCK)
+        except zmq.Again:
+            return False
+        self.stats.sent += 1
+        return True
+
+    def send_frame(self, frame, timestamp):
+        """Publish an image as header + raw buffer without copying it.
+
+        ZMQ keeps a reference to the pixels until they are on the wire,
+        so the caller must not write into `frame` afterwards.
+        """
+        self.seq += 1
+        frame = np.ascontiguousarray(frame)
+        header = pack_frame_header(frame, self.seq, timestamp)
+        try:
+            self.socket.send_multipart([header, frame], zmq.NOBLOCK, copy=False)
+        except zmq.Again:
+            return False
+        self.stats.sent += 1
+        return True
+
+    def close(self):
+        self.socket.close()
+
+
+class SubLink:
+    """Subscribing end of a link.
+
+    recv_obj() returns the next message according to the policy, or None
+    when nothing arrived within the timeout. `socket` can be registered
+    with a zmq.Poller; pending() tells whether a message is already
+    buffered locally (queue policy) and recv_obj(0) would return it.
+    """
+
+    def __init__(self, ctx, endpoint, policy=LATEST, depth=DEFAULT_QUEUE_DEPTH, name="link",
+                 multipart=False):
+        _check_policy(policy)
+        self.policy = policy
+        self.depth = depth
+        self.stats = LinkStats(name, publisher=False)
+        self.last_seq = None
+        self.buffer = deque(maxlen=depth if policy == QUEUE else None)
+        self.socket = ctx.socket(zmq.SUB)
+        if policy == LOSSLESS:
+            self.socket.setsockopt(zmq.RCVHWM, 0)
+        # Conflation keeps only the newest message in the receive queue,
+        # but ZMQ does not support it for multipart messages; those get a
+        # short queue instead
+        if policy == LATEST and not multipart:
+            self.socket.setsockopt(zmq.CONFLATE, 1)
+        elif policy == LATEST:
+            self.socket.setsockopt(zmq.RCVHWM, FRAME_HWM)
+        self.socket.connect(endpoint)
+        self.socket.setsockopt_string(zmq.SUBSCRIBE, "")
+
+    # ---- wire format hooks (overridden by multipart links) ----
+    def _recv_raw(self):
+        return self.socket.recv(zmq.NOBLOCK)
+
+    def _decode(self, raw):
+        seq, obj = pickle.loads(raw)
+        return seq, obj
+
+    # ---- delivery ----
+    def _read_available(self):
+        msgs = []
+        while True:
+            try:
+                msgs.append(self._recv_raw())
+            except zmq.Again:
+                return msgs
+
+    def _count_gap(self, seq):
+        # A sequence number that went backwards means the publisher restarted
+        if self.last_seq is not None and seq > self.last_seq + 1:
+            self.stats.dropped += seq - self.last_seq - 1
+        self.last_seq = seq
+
+    def _deliver(self, raw):
+        seq, obj = self._decode(raw)
+        self._count_gap(seq)
+        self.stats.delivered += 1
+        return obj
+
+    def pending(self):
+        return bool(self.buffer)
+
+    def recv_obj(self, timeout_ms=0):
+        """Next message per policy, or None. timeout_ms=None blocks."""
+        if not self.buffer:
+            if timeout_ms != 0 and not self.socket.poll(-1 if timeout_ms is None else timeout_ms):
+                return None
+            msgs = self._read_available()
+            if not msgs:
+                return None
+            if self.policy == LATEST:
+                # Only the newest is decoded; the skipped ones show up as a
+                # sequence gap when it is delivered
+                return self._deliver(msgs[-1])
+            # The buffer is bounded for the queue policy: appending to a full
+            # deque drops the oldest message, which again shows up as a gap
+            self.buffer.extend(msgs)
+
+        return self._deliver(self.buffer.popleft())
+
+    def close(self):
+        self.socket.close()
+
+
+class FrameSubLink(SubLink):
+    """Subscribing end of a frame link (see PubLink.send_frame).
+
+    The image is rebuilt directly over the received ZMQ buffer; only the
+    frame that is actually delivered gets decoded.
+    """
+
+    def __init__(self, ctx, endpoint, policy=LATEST, depth=DEFAULT_QUEUE_DEPTH, name="frames"):
+        super().__init__(ctx, endpoint, policy=policy, depth=depth, name=name, multipart=True)
+
+    def _recv_raw(self):
+        return self.socket.recv_multipart(zmq.NOBLOCK, copy=False)
+
+    def _decode(self, raw):
+        header, payload = raw
+        seq, timestamp, shape, dtype = unpack_frame_header(header.bytes)
+        frame = np.frombuffer(payload.buffer, dtype=dtype).reshape(shape)
+        return seq, (frame, timestamp)
+
+    def recv_frame(self, timeout_ms=0):
+        """(frame, capture timestamp) per policy, or None. timeout_ms=None blocks."""
+        return self.recv_obj(timeout_ms)
+
+
+# ---------------- Shared-memory frame ring ----------------
+RING_SLOTS = 4
+RING_POLL_INTERVAL = 0.001   # reader sleep while waiting for a frame or the ring
+
+
+class FrameRing:
+    """Single-writer ring of frame slots in shared memory.
+
+    Layout: slot count and size, the newest committed seq, one seqlock
+    counter per slot, one FRAME_HEADER per slot, then the pixel slots. The
+    writer makes a slot's counter odd, writes header and pixels, makes it
+    even again and then publishes the seq. A reader copies the newest slot out and keeps the
+    copy only if the counter was even and unchanged around it, so a frame
+    is never read half-written. It offers the same send_frame/recv_frame/
+    stats/close interface as the ZMQ frame links (always latest-only).
+
+    The writer creates the ring once it knows the frame size (slot_bytes,
+    normally the camera's first frame) and unlinks it on close; readers
+    attach by name with FrameRing.attach(). A frame larger than a slot is
+    not written and counts as dropped.
+
+    The seqlock relies on the stores to counters, header and pixels
+    becoming visible to the reader in program order. x86 guarantees that
+    and it has only been tested there; ARM (Apple Silicon included) may
+    reorder them, so a reader there could accept a torn frame.
+    """
+
+    def __init__(self, name=None, create=False, writer=False, slots=RING_SLOTS,
+                 slot_bytes=None, link_name="frame ring"):
+        if create:
+            if not slot_bytes:
+                raise ValueError("creating a frame ring needs slot_bytes")
+            header_bytes = 8 * (3 + slots) + FRAME_HEADER.size * slots
+            self.shm = shared_memory.SharedMemory(name=name, create=True,
+                                                  size=header_bytes + slots * slot_bytes)
+            # Geometry goes first so readers can attach by name alone
+            np.ndarray((2,), np.uint64, self.shm.buf)[:] = (slots, slot_bytes)
+        else:
+            self.shm = _attach_shm(name)
+            slots, slot_bytes = (int(v) for v in np.ndarray((2,), np.uint64, self.shm.buf))
+            if not slots:
+                # Created, but the writer has not written the geometry yet
+                self.shm.close()
+                raise FileNotFoundError(f"frame ring {name} is not initialised yet")
+            header_bytes = 8 * (3 + slots) + FRAME_HEADER.size * slots
+        self.owner = create
+        self.name = self.shm.name
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        buf = self.shm.buf
+        self._latest = np.ndarray((1,), np.uint64, buf, offset=16)
+        self._locks = np.ndarray((slots,), np.uint64, buf, offset=24)
+        self._headers = np.ndarray((slots, FRAME_HEADER.size), np.uint8, buf,
+                                   offset=8 * (3 + slots))
+        self._pixels = np.ndarray((slots, slot_bytes), np.uint8, buf, offset=header_bytes)
+        self.stats = LinkStats(link_name, publisher=writer)
+        self.seq = 0
+        self.last_seq = None
+        self._out = None
+
+    @classmethod
+    def attach(cls, name, link_name="frame ring", timeout=None):
+        """Attach to the ring `name` as a reader, waiting until the writer
+        has created it. Raises FileNotFoundError after timeout seconds
+        (None waits forever)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            try:
+                return cls(name, link_name=link_name)
+            except FileNotFoundError:
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise
+                time.sleep(RING_POLL_INTERVAL * 10)
+
+    # ---- writer ----
+    def send_frame(self, frame, timestamp):
+        """Write frame to the next slot; False when it does not fit one."""
+        frame = np.ascontiguousarray(frame)
+        if frame.nbytes > self.slot_bytes:
+            self.stats.dropped += 1
+            return False
+        self.seq += 1
+        slot = self.seq % self.slots
+        self._locks[slot] += 1   # odd: write in progress
+        self._headers[slot] = np.frombuffer(pack_frame_header(frame, self.seq, timestamp), np.uint8)
+        self._pixels[slot, :frame.nbytes] = frame.reshape(-1).view(np.uint8)
+        self._locks[slot] += 1   # even: slot consistent
+        self._latest[0] = self.seq
+        self.stats.sent += 1
+        return True
+
+    # ---- reader ----
+    def _try_read(self, seq):
+        slot = seq % self.slots
+        lock = int(self._locks[slot])
+        if lock & 1:
+            return None
+        header = self._headers[slot].tobytes()
+        if int(self._locks[slot]) != lock:
+            return None   # the header may be torn, do not parse it
+        frame_seq, timestamp, shape, dtype = unpack_frame_header(header)
+        if frame_seq != seq:
+            return None   # already overwritten by a newer frame
+        out = self._out
+        if out is None or out.shape != shape or out.dtype != dtype:
+            out = self._out = np.empty(shape, dtype)
+        out.reshape(-1).view(np.uint8)[:] = self._pixels[slot, :out.nbytes]
+        if int(self._locks[slot]) != lock:
+            return None   # torn read, the writer came around meanwhile
+        return out, timestamp
+
+    def recv_frame(self, timeout_ms=0):
+        """(newest frame, capture timestamp) not seen yet, or None.
+
+        The frame is a copy that stays valid until the next call.
+        timeout_ms=None blocks.
+        """
+        deadline = None if timeout_ms is None else time.monotonic() + timeout_ms / 1000.0
+        while True:
+            seq = int(self._latest[0])
+            if seq and seq != self.last_seq:
+                got = self._try_read(seq)
+                if got is not None:
+                    # A seq that went backwards means the writer restarted
+                    if self.last_seq is not None and seq > self.last_seq + 1:
+                        self.stats.dropped += seq - self.last_seq - 1
+                    self.last_seq = seq
+                    self.stats.delivered += 1
+                    return got
+                # The writer is on that slot right now; retry shortly
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(RING_POLL_INTERVAL)
+
+    def close(self):
+        # Views into the buffer must go before the mapping can be closed
+        self._latest = self._locks = self._headers = self._pixels = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def _attach_shm(name):
+    """Open an existing segment without handing it to this process's
+    resource tracker. Before Python 3.13 attaching registers the segment
+    too, and the tracker unlinks it (with a "leaked shared_memory"
+    warning) when the reader exits, under the writer's feet. This assumes
+    the reader does not share the writer's tracker, which holds for C and
+    A: each is forked from Main.py before either touches shared memory."""
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    shm = shared_memory.SharedMemory(name=name)
+    resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+def unlink_ring(name):
+    """Remove the ring `name` if it still exists (e.g. its writer was killed)."""
+    try:
+        shm = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
@@ -0,0 +1,88 @@
+"""Check A's ROI marker tracking against full-frame detection.
+
+Usage:
+    python ArUcoTrackerTest.py
+
+Synthetic frames with DICT_4X4_50 markers: two markers close enough for
+their ROIs to merge, another such pair, and a lone marker. After the
+first (full) scan MarkerTracker searches only the ROIs; it must report
+every marker once, with ids in detectMarkers' (N, 1) shape and the same
+corners a full-frame scan finds. A marker added later must be found by
+the periodic full scan.
+"""
+import os
+import sys
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Main"))
+
+from AreciboMessage.A_ArUcoDetector import FULL_SCAN_PERIOD, MarkerTracker, marker_rois  # noqa: E402
+
+FRAME_W, FRAME_H = 1280, 720
+MARKER_PX = 80
+SCENES = {
+    "two merged pairs and a lone marker": [(0, 200, 200), (1, 310, 200), (2, 700, 450), (3, 810, 450),
+                                           (4, 1100, 150)],
+    "one merged pair and a lone marker": [(0, 200, 200), (1, 310, 200), (4, 1100, 150)],
+    "one merged pair": [(2, 700, 450), (3, 810, 450)],
+}
+NEW_MARKER = (5, 400, 550)
+
+
+def synthetic_frame(markers, shift=0):
+    dictionary = cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_4X4_50)
+    gray = np.full((FRAME_H, FRAME_W), 255, np.uint8)
+    for marker_id, x, y in markers:
+        x += shift
+        gray[y:y + MARKER_PX, x:x + MARKER_PX] = cv2.aruco.generateImageMarker(dictionary, marker_id, MARKER_PX)
+    return gray
+
+
+def by_id(corners, ids):
+    return {int(i): c.reshape(4, 2) for i, c in zip(ids.flatten(), corners)}
+
+
+def check_scene(name, markers):
+    detector = cv2.aruco.ArucoDetector(cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_4X4_50),
+                                       cv2.aruco.DetectorParameters())
+    tracker = MarkerTracker(detector)
+    tracker.detect(synthetic_frame(markers), 0.0)
+
+    # Small move, before the next full scan is due: the markers stay
+    # inside their ROIs
+    gray = synthetic_frame(markers, shift=3)
+    rois = marker_rois([c for c, _ in tracker.known.values()], gray.shape)
+    corners, ids = tracker.detect(gray, 0.1)
+    ref_corners, ref_ids, _ = detector.detectMarkers(gray)
+
+    problems = []
+    if tracker.full_scans != 1:
+        problems.append(f"{tracker.full_scans} full scans, expected only the first")
+    if ids is None or ids.ndim != 2 or ids.shape[1] != 1:
+        problems.append(f"ids shape {None if ids is None else ids.shape}, expected (N, 1)")
+    else:
+        found, ref = by_id(corners, ids), by_id(ref_corners, ref_ids)
+        if len(ids) != len(markers) or sorted(found) != sorted(m[0] for m in markers):
+            problems.append(f"ids {ids.flatten().tolist()}")
+        elif any(np.abs(found[i] - ref[i]).max() > 1e-3 for i in ref):
+            problems.append("corners differ from the full-frame scan")
+
+    # A marker placed while the scene is still: found by the next full scan,
+    # which is due after FULL_SCAN_PERIOD seconds whatever the frame count
+    _, ids = tracker.detect(synthetic_frame(markers + [NEW_MARKER], shift=3), 0.1 + FULL_SCAN_PERIOD)
+    if ids is None or NEW_MARKER[0] not in ids.flatten().tolist():
+        problems.append("a new marker was not found by the periodic full scan")
+    status = "ok" if not problems else "FAILED: " + "; ".join(problems)
+    print(f"{name}: {len(rois)} ROIs for {len(markers)} markers, {status}")
+    return not problems
+
+
+def main():
+    ok = all([check_scene(name, markers) for name, markers in SCENES.items()])
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
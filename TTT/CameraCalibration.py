@@ -1,22 +1,124 @@
+"""Camera calibration from a 9x6 chessboard.
+
+Usage:
+    python CameraCalibration.py                      # live: save views, then calibrate
+    python CameraCalibration.py --images DIR [-j N]  # batch over saved images
+
+Both write the calibration cache read by A_ArUcoDetector (intrinsics plus
+undistortion maps); the live mode also keeps writing camera_params.npz.
+"""
+import argparse
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+
 import cv2
 import numpy as np
-import os
 
 # Chessboard inner corners (9x6)
 CHESSBOARD = (9, 6)
 SQUARE_SIZE = 0.025  # 2.5 cm square (change if needed)
 
 SAVE_DIR = "calibration_images"
-os.makedirs(SAVE_DIR, exist_ok=True)
 
+SUBPIX_CRITERIA = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001)
+IMAGE_PATTERNS = ("*.png", "*.jpg", "*.jpeg", "*.bmp")
 
-def main():
-    cap = cv2.VideoCapture(0)
+# Calibration cache loaded by A_ArUcoDetector; keep the version in sync
+CALIBRATION_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "Main", "AreciboMessage", "camera_calibration.npz")
+CALIBRATION_VERSION = 1
 
+
+def board_points():
     # prepare object points: (0,0,0), (1,0,0), ..., (8,5,0)
     objp = np.zeros((CHESSBOARD[0] * CHESSBOARD[1], 3), np.float32)
     objp[:, :2] = np.mgrid[0:CHESSBOARD[0], 0:CHESSBOARD[1]].T.reshape(-1, 2)
     objp *= SQUARE_SIZE
+    return objp
+
+
+def save_calibration(path, camera_matrix, dist_coeffs, image_size, rms):
+    """Write intrinsics plus initUndistortRectifyMap maps for image_size (w, h)."""
+    new_camera_matrix, _ = cv2.getOptimalNewCameraMatrix(camera_matrix, dist_coeffs,
+                                                         image_size, 0)
+    # Fixed-point maps: smaller on disk and faster in cv2.remap
+    map1, map2 = cv2.initUndistortRectifyMap(camera_matrix, dist_coeffs, None,
+                                             new_camera_matrix, image_size, cv2.CV_16SC2)
+    np.savez(path,
+             version=CALIBRATION_VERSION,
+             image_size=np.array(image_size),
+             rms=rms,
+             camera_matrix=camera_matrix,
+             dist_coeffs=dist_coeffs,
+             new_camera_matrix=new_camera_matrix,
+             map1=map1,
+             map2=map2)
+    print(f"Saved calibration cache to '{os.path.normpath(path)}'")
+
+
+def find_board(path):
+    """Worker: (path, (w, h), refined corners or None) for one image."""
+    gray = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        return path, None, None
+    size = gray.shape[::-1]
+    flags = cv2.CALIB_CB_ADAPTIVE_THRESH | cv2.CALIB_CB_NORMALIZE_IMAGE | cv2.CALIB_CB_FAST_CHECK
+    found, corners = cv2.findChessboardCorners(gray, CHESSBOARD, flags)
+    if not found:
+        return path, size, None
+    corners = cv2.cornerSubPix(gray, corners, (11, 11), (-1, -1), criteria=SUBPIX_CRITERIA)
+    return path, size, corners
+
+
+def calibrate_folder(folder, workers=None, out=CALIBRATION_FILE):
+    paths = sorted(p for pattern in IMAGE_PATTERNS for p in glob.glob(os.path.join(folder, pattern)))
+    if not paths:
+        print("No images found in", folder)
+        return
+
+    objp = board_points()
+    objpoints = []
+    imgpoints = []
+    image_size = None
+    # Corner search is the expensive part and independent per image
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for path, size, corners in pool.map(find_board, paths, chunksize=4):
+            if size is None:
+                print("Unreadable:", path)
+                continue
+            if image_size is None:
+                image_size = size
+            elif size != image_size:
+                print(f"Skipped {path}: size {size} differs from {image_size}")
+                continue
+            if corners is None:
+                print("No chessboard:", path)
+                continue
+            objpoints.append(objp)
+            imgpoints.append(corners)
+
+    print(f"Chessboard found in {len(imgpoints)} of {len(paths)} images")
+    if len(imgpoints) < 10:
+        print("Not enough images (need >= 10).")
+        return
+
+    rms, camera_matrix, dist_coeffs, _, _ = cv2.calibrateCamera(
+        objpoints, imgpoints, image_size, None, None
+    )
+    print("\n=== Calibration Result ===")
+    print("RMS error:", rms)
+    print("Camera matrix:\n", camera_matrix)
+    print("Distortion coefficients:\n", dist_coeffs.ravel())
+
+    save_calibration(out, camera_matrix, dist_coeffs, image_size, rms)
+
+
+def live(out=CALIBRATION_FILE):
+    os.makedirs(SAVE_DIR, exist_ok=True)
+    cap = cv2.VideoCapture(0)
+
+    objp = board_points()
 
     objpoints = []  # 3D points
     imgpoints = []  # 2D points
@@ -30,15 +132,17 @@ def main():
         ret, frame = cap.read()
         if not ret:
             break
-        frame = cv2.flip(frame, 1)
 
+        # Detect on and save the raw frame: A undistorts unmirrored camera
+        # frames, so only the preview is drawn on and mirrored
         gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
         found, corners = cv2.findChessboardCorners(gray, CHESSBOARD, None)
 
+        preview = frame.copy()
         if found:
-            cv2.drawChessboardCorners(frame, CHESSBOARD, corners, found)
+            cv2.drawChessboardCorners(preview, CHESSBOARD, corners, found)
 
-        cv2.imshow("Calibration", frame)
+        cv2.imshow("Calibration", cv2.flip(preview, 1))
         key = cv2.waitKey(1)
 
         if key == ord("s") and found:
@@ -50,7 +154,7 @@ def main():
                 corners,
                 (11, 11),
                 (-1, -1),
-                criteria=(cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001),
+                criteria=SUBPIX_CRITERIA,
             )
             imgpoints.append(corners2)
             img_count += 1
@@ -88,6 +192,19 @@ def main():
              dist_coeffs=dist_coeffs)
 
     print("\nSaved to 'camera_params.npz'")
+    save_calibration(out, camera_matrix, dist_coeffs, gray.shape[::-1], ret)
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--images", default=None, help="Calibrate from the chessboard images in this folder")
+    p.add_argument("-j", "--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    p.add_argument("--out", default=CALIBRATION_FILE, help="Calibration cache file")
+    args = p.parse_args()
+    if args.images:
+        calibrate_folder(args.images, args.workers, args.out)
+    else:
+        live(args.out)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,235 @@
+"""Check and time B's batched ray tracer against a scalar reference.
+
+Usage:
+    python RayTest.py              # equivalence on random scenes, then timing
+    python RayTest.py --scenes 300 --frames 40
+
+reference_trace is the original one-ray-at-a-time tracer of B (stack of
+reflection branches, nearest edge by looping over every edge) with the
+Fresnel energy rules B_AreciboMessage.trace_tree uses. trace_rays must
+produce the same segments, in the same order, with the same flags.
+
+The timing runs on the scenes B actually sees: six non-overlapping
+prisms (ArUco ids 0-5) placed on the source lines.
+"""
+import argparse
+import contextlib
+import io
+import math
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Main"))
+
+from AreciboMessage import B_AreciboMessage as B  # noqa: E402
+from AreciboMessage.B_AreciboMessage import (  # noqa: E402
+    EPS, HEIGHT, MAX_BOUNCES, MAX_TRACE_SEGMENTS, MIN_RAY_ENERGY, REFRACTIVE_INDEX_AIR,
+    REFRACTIVE_INDEX_SHAPE, TINY, WIDTH, outward_normal, point_in_poly, ray_segment_intersection,
+    v_add, v_dot, v_mul, v_norm, v_sub,
+)
+
+TOLERANCE = 1e-9   # px, segment end points
+
+SOURCES = [(0.0, HEIGHT * 0.25), (0.0, HEIGHT * 0.50), (0.0, HEIGHT * 0.75),
+           (WIDTH, HEIGHT * 0.25), (WIDTH, HEIGHT * 0.50), (WIDTH, HEIGHT * 0.75)]
+DIRECTIONS = [(1.0, 0.0)] * 3 + [(-1.0, 0.0)] * 3
+
+
+# ---------------- Scalar reference ----------------
+def fresnel(v, n, n1, n2):
+    """(new direction, reflectance) as B's _refract_or_reflect_rows."""
+    if v_dot(n, v) > 0:
+        n = v_mul(n, -1.0)
+    cos_i = max(-1.0, min(1.0, -v_dot(n, v)))
+    ratio = n1 / n2
+    sin_t2 = ratio * ratio * max(0.0, 1.0 - cos_i * cos_i)
+    if sin_t2 > 1.0 - 1e-12:
+        return v_norm(v_sub(v, v_mul(n, 2.0 * v_dot(v, n)))), 1.0
+    cos_t = math.sqrt(max(0.0, 1.0 - sin_t2))
+    tdir = v_add(v_mul(v, ratio), v_mul(n, ratio * cos_i - cos_t))
+    rs = (n1 * cos_i - n2 * cos_t) / (n1 * cos_i + n2 * cos_t)
+    rp = (n1 * cos_t - n2 * cos_i) / (n1 * cos_t + n2 * cos_i)
+    return v_norm(tdir), min(0.5 * (rs * rs + rp * rp), 1.0)
+
+
+def reference_trace(origin, direction, shapes):
+    out_segments = []
+    stack = [(origin, v_norm(direction), False, 1.0)]   # (p, v, is_reflect_branch, energy)
+
+    edges = []
+    for pid, sh in enumerate(shapes):
+        poly = sh["poly"]
+        for j in range(len(poly)):
+            edges.append((poly[j], poly[(j + 1) % len(poly)], pid))
+
+    while stack:
+        p, v, is_reflect, energy = stack.pop()
+        v = v_norm(v)
+        if v == (0.0, 0.0):
+            continue
+
+        inside_set = set()
+        for pid, sh in enumerate(shapes):
+            if point_in_poly(v_add(p, v_mul(v, TINY)), sh["poly"]):
+                inside_set.add(pid)
+
+        for _ in range(MAX_BOUNCES):
+            nearest_t = float("inf")
+            nearest_edge = None
+            for a, b, pid in edges:
+                res = ray_segment_intersection(p, v, a, b)
+                if res is None:
+                    continue
+                t, u = res
+                if t <= EPS or not (0 <= u <= 1):
+                    continue
+                if t < nearest_t:
+                    nearest_t = t
+                    nearest_edge = (a, b, pid)
+
+            if nearest_edge is None:
+                t_candidates = []
+                if abs(v[0]) > 1e-9:
+                    t_candidates.append((WIDTH + 50 - p[0]) / v[0] if v[0] > 0 else (-50 - p[0]) / v[0])
+                if abs(v[1]) > 1e-9:
+                    t_candidates.append((HEIGHT + 50 - p[1]) / v[1] if v[1] > 0 else (-50 - p[1]) / v[1])
+                t_candidates = [tc for tc in t_candidates if tc > 0]
+                if t_candidates:
+                    out_segments.append((p, v_add(p, v_mul(v, min(t_candidates))),
+                                         len(inside_set) > 0, is_reflect))
+                break
+
+            a, b, pid = nearest_edge
+            inter = v_add(p, v_mul(v, nearest_t))
+            out_segments.append((p, inter, len(inside_set) > 0, is_reflect))
+
+            was_inside = point_in_poly(v_sub(inter, v_mul(v, TINY)), shapes[pid]["poly"])
+            n1 = REFRACTIVE_INDEX_SHAPE if was_inside else REFRACTIVE_INDEX_AIR
+            n2 = REFRACTIVE_INDEX_AIR if was_inside else REFRACTIVE_INDEX_SHAPE
+            nvec = outward_normal(a, b, shapes[pid]["poly"])
+            newv, R = fresnel(v, nvec, n1, n2)
+
+            if not was_inside and energy * R >= MIN_RAY_ENERGY:
+                refl_dir = v_norm(v_sub(v, v_mul(nvec, 2 * v_dot(v, nvec))))
+                stack.append((v_add(inter, v_mul(refl_dir, TINY)), refl_dir, True, energy * R))
+            if R < 1.0:
+                energy *= 1.0 - R
+
+            p = v_add(inter, v_mul(newv, TINY))
+            v = newv
+            if point_in_poly(v_add(inter, v_mul(v, TINY)), shapes[pid]["poly"]):
+                inside_set.add(pid)
+            else:
+                inside_set.discard(pid)
+
+            if p[0] < -200 or p[0] > WIDTH + 200 or p[1] < -200 or p[1] > HEIGHT + 200:
+                break
+            if energy < MIN_RAY_ENERGY:
+                break
+
+    return out_segments
+
+
+# ---------------- Scenes ----------------
+def shapes_for(items):
+    with contextlib.redirect_stdout(io.StringIO()):   # shapes_from_aruco prints positions
+        return B.shapes_from_aruco(items)
+
+
+def random_scene(rng):
+    """Up to six prisms anywhere, overlaps allowed."""
+    items = [{"id": rng.randrange(6), "x": rng.uniform(0, B.CAM_W), "y": rng.uniform(0, B.CAM_H),
+              "yaw": rng.uniform(0, 360)} for _ in range(rng.randint(0, 6))]
+    return shapes_for(items)
+
+
+def installation_scene(rng):
+    """Six non-overlapping prisms, each on one of the source lines."""
+    shapes = []
+    for marker_id in range(6):
+        for _ in range(200):
+            y = rng.choice(SOURCES)[1] + rng.uniform(-30, 30)
+            item = {"id": marker_id, "x": rng.uniform(150, WIDTH - 150) / WIDTH * B.CAM_W,
+                    "y": y / HEIGHT * B.CAM_H, "yaw": rng.uniform(0, 360)}
+            sh = shapes_for([item])[0]
+            if not any(B.aabb_overlap(sh["aabb"], other["aabb"]) for other in shapes):
+                shapes.append(sh)
+                break
+    return shapes
+
+
+# ---------------- Checks ----------------
+def same_segments(a, b):
+    if len(a) != len(b):
+        return False
+    for s, r in zip(a, b):
+        if s[2:] != r[2:]:
+            return False
+        if max(abs(s[0][0] - r[0][0]), abs(s[0][1] - r[0][1]),
+               abs(s[1][0] - r[1][0]), abs(s[1][1] - r[1][1])) > TOLERANCE:
+            return False
+    return True
+
+
+def check_equivalence(num_scenes, seed=0):
+    rng = random.Random(seed)
+    failed = 0
+    for k in range(num_scenes):
+        shapes = random_scene(rng)
+        batched = B.trace_rays(SOURCES, DIRECTIONS, B.Scene(shapes))
+        reference = [reference_trace(o, d, shapes) for o, d in zip(SOURCES, DIRECTIONS)]
+        # The reference has no segment budget
+        assert sum(map(len, reference)) < MAX_TRACE_SEGMENTS
+        if not all(same_segments(a, b) for a, b in zip(batched, reference)):
+            failed += 1
+            print(f"scene {k}: trace_rays differs from the reference")
+    print(f"equivalence: {num_scenes - failed}/{num_scenes} random scenes match")
+    return failed == 0
+
+
+def best_of(fn, repeat=7):
+    fn()
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def time_installation(num_frames, seed=1):
+    rng = random.Random(seed)
+    scenes = [installation_scene(rng) for _ in range(num_frames)]
+
+    def scalar():
+        for shapes in scenes:
+            for o, d in zip(SOURCES, DIRECTIONS):
+                reference_trace(o, d, shapes)
+
+    def batched():
+        # Compiling the scene is part of a new configuration's cost
+        for shapes in scenes:
+            B.trace_rays(SOURCES, DIRECTIONS, B.Scene(shapes))
+
+    segments = sum(len(s) for shapes in scenes
+                   for s in B.trace_rays(SOURCES, DIRECTIONS, B.Scene(shapes)))
+    print(f"timing: {num_frames} installation scenes, {segments / num_frames:.1f} segments per frame")
+    for name, fn in (("scalar reference", scalar), ("trace_rays", batched)):
+        print(f"  {name:17s} {best_of(fn) / num_frames * 1000.0:.3f} ms per frame")
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--scenes", type=int, default=300, help="Random scenes for the equivalence check")
+    p.add_argument("--frames", type=int, default=40, help="Installation scenes for the timing")
+    args = p.parse_args()
+    ok = check_equivalence(args.scenes)
+    time_installation(args.frames)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()